@@ -1,7 +1,12 @@
 from django.contrib import admin
-from .models import Job, Metric, Measurement, VersionedPackage
+from .models import Job, Metric, Measurement, VersionedPackage, \
+    ChangedPackage, Blob, JobBlob, Ingestion
 
 admin.site.register(Job)
 admin.site.register(Metric)
 admin.site.register(Measurement)
 admin.site.register(VersionedPackage)
+admin.site.register(ChangedPackage)
+admin.site.register(Blob)
+admin.site.register(JobBlob)
+admin.site.register(Ingestion)
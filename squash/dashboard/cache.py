@@ -0,0 +1,380 @@
+"""Response caching for the API endpoints.
+
+Cached responses are keyed by generation counters of the datasets and
+metrics they depend on. Counters of a dataset are bumped when its jobs
+or measurements are written, counters of a metric when its definition
+is, so responses can be cached indefinitely and still reflect new data
+as soon as it is ingested. The same counters are used
+to answer conditional requests from the bokeh apps.
+
+The cache is shared by all the processes, see CACHES in the settings,
+so that a write in any process invalidates the responses cached by the
+others. When the cache is full it may drop a generation counter, the
+counter then takes a new value, never a previous one, so the responses
+depending on it are only computed again, they are never stale.
+
+The summary of the database shown by the home page is also kept in the
+cache, keyed by the generation counters of all the datasets and
+metrics, so it is computed again after any write.
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from functools import wraps
+
+from django.core.cache import cache
+from django.http import HttpResponseNotModified
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, \
+    quote_etag
+from rest_framework_extensions.cache.decorators import CacheResponse
+from rest_framework_extensions.key_constructor import bits
+from rest_framework_extensions.key_constructor.constructors import \
+    DefaultListKeyConstructor, DefaultObjectKeyConstructor
+
+# Generation counter that changes on any write to the scope
+ANY = '*'
+
+STATS = ('hits', 'misses', 'invalidations')
+
+# Seconds between the updates of the shared cache statistics by a process
+STATS_INTERVAL = 10
+
+# The home page summary expires so that writes not sending signals,
+# e.g. queryset updates, are eventually shown
+SUMMARY_TIMEOUT = 3600
+
+
+def get_generation_key(scope, name):
+    return 'squash:generation:{}:{}'.format(scope, name)
+
+
+def new_generation():
+    """Return a generation counter value not used before.
+
+    Values start from the current time, so that a counter evicted from
+    the cache never returns to a previous value, and have random low
+    digits, so that concurrent writes in different processes never set
+    the same value. The shared cache does not increment atomically.
+    """
+
+    return int(time.time() * 1000) * 1000000 + random.randrange(1000000)
+
+
+def get_generation(scope, name=None):
+    """Return the generation counter of a dataset or metric, or of any
+    dataset or metric if name is None
+    """
+
+    key = get_generation_key(scope, name or ANY)
+    generation = cache.get(key)
+
+    if generation is None:
+        cache.add(key, new_generation(), None)
+        generation = cache.get(key)
+
+    return generation
+
+
+def get_modified_key(scope, name):
+    return 'squash:modified:{}:{}'.format(scope, name)
+
+
+def get_modified(scope, name=None):
+    """Return the time of the last write to a dataset or metric, or to
+    any dataset or metric if name is None
+    """
+
+    key = get_modified_key(scope, name or ANY)
+    modified = cache.get(key)
+
+    if modified is None:
+        # the time of the last write is unknown, assume it is now
+        cache.add(key, int(time.time()), None)
+        modified = cache.get(key)
+
+    return modified
+
+
+def bump_generation(scope, name):
+
+    cache.set(get_generation_key(scope, name), new_generation(), None)
+    cache.set(get_modified_key(scope, name), int(time.time()), None)
+
+
+def get_stat_key(name):
+    return 'squash:cache:{}'.format(name)
+
+
+# Statistics counted by this process and not yet added to the shared
+# counters
+_stats = dict.fromkeys(STATS, 0)
+_stats_flushed = time.time()
+_stats_lock = threading.Lock()
+
+
+def incr_stat(name):
+    """Count a cache hit, miss or invalidation. Counts are added to the
+    shared counters at most every STATS_INTERVAL seconds, so that reads
+    do not write to the cache.
+    """
+
+    with _stats_lock:
+        _stats[name] += 1
+        due = time.time() - _stats_flushed >= STATS_INTERVAL
+
+    if due:
+        flush_stats()
+
+
+def flush_stats():
+    """Add the statistics counted by this process to the shared counters.
+
+    The shared cache does not increment atomically, counts added
+    concurrently by other processes may be lost, the statistics are
+    only an estimate.
+    """
+    global _stats_flushed
+
+    with _stats_lock:
+        counts = dict(_stats)
+        _stats.update(dict.fromkeys(STATS, 0))
+        _stats_flushed = time.time()
+
+    for name, count in counts.items():
+        if count:
+            key = get_stat_key(name)
+            cache.set(key, cache.get(key, 0) + count, None)
+
+
+def get_stats():
+    """Return the number of cache hits, misses and invalidations"""
+
+    flush_stats()
+
+    return {name: cache.get(get_stat_key(name), 0) for name in STATS}
+
+
+def invalidate(datasets=(), metrics=()):
+    """Invalidate cached responses that depend on the given
+    datasets and metrics
+    """
+
+    for scope, names in (('dataset', set(datasets)),
+                         ('metric', set(metrics))):
+        if names:
+            for name in names:
+                bump_generation(scope, name)
+            bump_generation(scope, ANY)
+
+    incr_stat('invalidations')
+
+
+def get_summary_key(dataset_generation, metric_generation):
+    return 'squash:summary:{}:{}'.format(dataset_generation,
+                                         metric_generation)
+
+
+def get_summary(compute):
+    """Return the summary of the database shown by the home page, it is
+    computed by compute() only if it is not cached.
+
+    The generations are read before the summary is computed. A write
+    committed meanwhile changes them after the commit, so a summary
+    missing the write is cached under a key that is not read again.
+    """
+
+    key = get_summary_key(get_generation('dataset'),
+                          get_generation('metric'))
+    summary = cache.get(key)
+
+    if summary is None:
+        summary = compute()
+        cache.set(key, summary, SUMMARY_TIMEOUT)
+
+    return summary
+
+
+def get_scope_names(view_instance, request, kwargs):
+    """Return the dataset and metric a view depends on, as
+    (scope, name) pairs.
+
+    Views list the scopes they depend on in cache_scopes. The query
+    parameter or URL kwarg holding the name of the dataset or metric is
+    given by the view cache_dataset_param and cache_metric_param
+    attributes, the name is None if the view depends on every dataset
+    or metric.
+    """
+
+    scope_names = []
+
+    for scope in getattr(view_instance, 'cache_scopes', ()):
+        param = getattr(view_instance, 'cache_{}_param'.format(scope), None)
+
+        name = None
+        if param in kwargs:
+            name = kwargs[param]
+        elif param is not None:
+            name = request.query_params.get(param)
+
+        scope_names.append((scope, name))
+
+    return scope_names
+
+
+def get_generations(view_instance, request, kwargs):
+
+    return {scope: get_generation(scope, name)
+            for scope, name in get_scope_names(view_instance, request,
+                                               kwargs)}
+
+
+class GenerationKeyBit(bits.KeyBitBase):
+    """Generation counters of the dataset and metric requested"""
+
+    def get_data(self, params, view_instance, view_method, request, args,
+                 kwargs):
+
+        return get_generations(view_instance, request, kwargs)
+
+
+class ListKeyConstructor(DefaultListKeyConstructor):
+    generation = GenerationKeyBit()
+    # pagination cursors and options that do not change the SQL query
+    query_params = bits.QueryParamsKeyBit()
+
+
+class ObjectKeyConstructor(DefaultObjectKeyConstructor):
+    generation = GenerationKeyBit()
+
+
+class CountingCacheResponse(CacheResponse):
+    """Cache responses and count cache hits and misses"""
+
+    def process_cache_response(self, view_instance, view_method, request,
+                               args, kwargs):
+
+        key = self.calculate_key(view_instance=view_instance,
+                                 view_method=view_method,
+                                 request=request,
+                                 args=args,
+                                 kwargs=kwargs)
+
+        response = self.cache.get(key)
+
+        if response:
+            incr_stat('hits')
+        else:
+            incr_stat('misses')
+            response = view_method(view_instance, request, *args, **kwargs)
+            response = view_instance.finalize_response(request, response,
+                                                       *args, **kwargs)
+            # should be rendered before pickling while storing to cache
+            response.render()
+
+            if not response.status_code >= 400 or self.cache_errors:
+                self.cache.set(key, response, self.timeout)
+
+        if not hasattr(response, '_closable_objects'):
+            response._closable_objects = []
+
+        return response
+
+
+cache_response = CountingCacheResponse
+
+
+def get_validators(view_instance, request, kwargs):
+    """Return the ETag and the last modified time of a response, derived
+    from the generation counters of the dataset and metric requested
+    """
+
+    scope_names = get_scope_names(view_instance, request, kwargs)
+
+    generations = {scope: get_generation(scope, name)
+                   for scope, name in scope_names}
+
+    renderer = getattr(request, 'accepted_renderer', None)
+
+    etag = hashlib.md5(json.dumps({
+        'path': request.get_full_path(),
+        'format': getattr(renderer, 'format', None),
+        'generations': generations,
+    }, sort_keys=True).encode('utf-8')).hexdigest()
+
+    last_modified = max([get_modified(scope, name)
+                         for scope, name in scope_names] or [0])
+
+    return etag, last_modified
+
+
+def is_not_modified(request, etag, last_modified):
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+
+    # If-Modified-Since is ignored when If-None-Match is sent
+    if if_none_match is not None:
+        # GZipMiddleware appends ;gzip to the ETag of compressed responses
+        etags = [re.sub(';gzip$', '', e) for e in parse_etags(if_none_match)]
+        return etag in etags or '*' in etags
+
+    if_modified_since = parse_http_date_safe(
+        request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+
+    if if_modified_since is not None:
+        return last_modified <= if_modified_since
+
+    return False
+
+
+def conditional(func):
+    """Decorator for view methods answering conditional GET requests.
+
+    Responses carry an ETag and a Last-Modified header, a request whose
+    validators match gets a 304 response and the view method is not
+    called.
+    """
+
+    @wraps(func)
+    def inner(self, request, *args, **kwargs):
+
+        etag, last_modified = get_validators(self, request, kwargs)
+
+        if is_not_modified(request, etag, last_modified):
+            response = HttpResponseNotModified()
+        else:
+            response = func(self, request, *args, **kwargs)
+
+        if response.status_code in (200, 304):
+            response['ETag'] = quote_etag(etag)
+            response['Last-Modified'] = http_date(last_modified)
+
+        return response
+
+    return inner
+
+
+class CacheResponseMixin(object):
+    """Cache list and retrieve responses until the datasets and metrics
+    they depend on are written, and answer conditional requests for them
+    """
+
+    cache_scopes = ()
+    cache_dataset_param = None
+    cache_metric_param = None
+
+    list_cache_key_func = ListKeyConstructor()
+    object_cache_key_func = ObjectKeyConstructor()
+
+    @conditional
+    @cache_response(key_func='list_cache_key_func')
+    def list(self, request, *args, **kwargs):
+        return super(CacheResponseMixin, self).list(request, *args, **kwargs)
+
+    @conditional
+    @cache_response(key_func='object_cache_key_func')
+    def retrieve(self, request, *args, **kwargs):
+        return super(CacheResponseMixin, self).retrieve(request, *args,
+                                                        **kwargs)
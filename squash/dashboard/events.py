@@ -0,0 +1,39 @@
+"""Notification of new jobs to the bokeh sessions.
+
+The API publishes an event when a job is ingested, as a JSON datagram
+sent to a local UDP socket. The bokeh server listens on that socket and
+forwards the event to the sessions showing the dataset and one of the
+metrics of the job, see viz/events.py.
+"""
+import json
+import logging
+import socket
+
+# the address is defined once for the publisher and the bokeh server,
+# viz/events.py imports only the standard library
+from .viz.events import SQUASH_EVENTS_ADDRESS, parse_address
+
+logger = logging.getLogger(__name__)
+
+
+def publish(ci_dataset, metrics, job_id, address=None):
+    """Publish that a job measuring metrics for a dataset was ingested.
+
+    Events are sent without waiting for the bokeh server, they are lost
+    if it is not listening.
+    """
+
+    address = SQUASH_EVENTS_ADDRESS if address is None else address
+
+    if not address:
+        return
+
+    event = json.dumps({'ci_dataset': ci_dataset,
+                        'metrics': sorted(set(metrics)),
+                        'job_id': job_id}).encode('utf-8')
+
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.sendto(event, parse_address(address))
+    except OSError as e:
+        logger.warning('Could not publish event to %s: %s', address, e)
@@ -1,8 +1,74 @@
+from datetime import timedelta
+
 import django_filters
-from .models import Job
+from .models import Job, Measurement
+
+# Time windows used by the monitor app, a window is resolved
+# backwards from the date of the latest job of the dataset
+TIME_WINDOWS = {'weeks': timedelta(weeks=1),
+                'months': timedelta(days=30*3),
+                'years': timedelta(days=365)}
+
+# Accept ISO 8601 dates as returned by the API, e.g 2016-08-10T05:22:37.700146Z
+DATETIME_INPUT_FORMATS = ('%Y-%m-%dT%H:%M:%S.%fZ',
+                          '%Y-%m-%dT%H:%M:%SZ',
+                          '%Y-%m-%dT%H:%M:%S.%f',
+                          '%Y-%m-%dT%H:%M:%S',
+                          '%Y-%m-%d %H:%M:%S.%f',
+                          '%Y-%m-%d %H:%M:%S',
+                          '%Y-%m-%d')
+
+
+def get_window_start(ci_dataset, window):
+    """Return the datetime where a named time window starts for
+    a given dataset, or None if the window covers everything
+    """
+
+    if window not in TIME_WINDOWS:
+        return None
+
+    jobs = Job.objects.all()
+    if ci_dataset:
+        jobs = jobs.filter(ci_dataset=ci_dataset)
+
+    last = jobs.order_by('-date').values_list('date', flat=True).first()
+
+    if last is None:
+        return None
+
+    return last - TIME_WINDOWS[window]
 
 
 class JobFilter(django_filters.FilterSet):
     class Meta:
         model = Job
         fields = ('ci_id', 'ci_dataset', 'ci_label', 'packages')
+
+
+class MeasurementFilter(django_filters.FilterSet):
+    """Filter measurements by dataset, metric and job date, the date range
+    is given by since and until or by a named time window
+    """
+
+    since = django_filters.DateTimeFilter(
+        name='job__date', lookup_type='gte',
+        input_formats=DATETIME_INPUT_FORMATS)
+
+    until = django_filters.DateTimeFilter(
+        name='job__date', lookup_type='lte',
+        input_formats=DATETIME_INPUT_FORMATS)
+
+    window = django_filters.MethodFilter(action='filter_window')
+
+    class Meta:
+        model = Measurement
+        fields = ('job__ci_dataset', 'metric', 'since', 'until', 'window')
+
+    def filter_window(self, queryset, value):
+
+        start = get_window_start(self.data.get('job__ci_dataset'), value)
+
+        if start is not None:
+            queryset = queryset.filter(job__date__gte=start)
+
+        return queryset
@@ -0,0 +1,115 @@
+"""Asynchronous ingestion of jobs.
+
+Jobs posted to the jobs endpoint with the Prefer: respond-async header
+are not parsed by the request, their raw payload is queued in the
+database and the response returns at once with the URL of the ingestion
+status. Workers started by the ingest_worker command claim queued
+ingestions, validate and write their job as the jobs endpoint does and
+record the outcome. The database is the queue, there is no broker.
+"""
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .models import Ingestion
+from .serializers import JobSerializer
+
+try:
+    async_ingestion = settings.ASYNC_INGESTION
+except AttributeError:
+    # if not specified jobs are always ingested by the request
+    async_ingestion = False
+
+try:
+    ingestion_timeout = settings.INGESTION_TIMEOUT
+except AttributeError:
+    ingestion_timeout = 3600
+
+try:
+    ingestion_max_attempts = settings.INGESTION_MAX_ATTEMPTS
+except AttributeError:
+    ingestion_max_attempts = 3
+
+# Seconds a worker waits before looking for jobs again when the
+# queue is empty
+POLL_INTERVAL = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+def prefers_async(request):
+    """Return True if the client asked for the job to be ingested
+    asynchronously, with the Prefer: respond-async header
+    """
+
+    preferences = request.META.get('HTTP_PREFER', '').split(',')
+
+    return any(preference.split(';')[0].strip().lower() == 'respond-async'
+               for preference in preferences)
+
+
+def ingest(ingestion):
+    """Validate and write the job of a claimed ingestion, and record
+    the job or the errors
+    """
+
+    try:
+        data = json.loads(bytes(ingestion.payload).decode('utf-8'))
+    except (TypeError, ValueError) as e:
+        ingestion.finish(errors={'detail': 'JSON parse error - {}'.
+                                 format(e)})
+        return
+
+    serializer = JobSerializer(data=data)
+
+    if not serializer.is_valid():
+        ingestion.finish(errors=serializer.errors)
+        return
+
+    try:
+        # The job and the status are committed together. The ingestion is
+        # locked, a worker that claimed it again waits for this one and
+        # does not write the job twice.
+        with transaction.atomic():
+            current = Ingestion.objects.select_for_update().\
+                get(pk=ingestion.pk)
+
+            if current.status != Ingestion.RUNNING:
+                return
+
+            job = serializer.write(dict(serializer.validated_data))
+            current.finish(job=job)
+    except Exception as e:
+        # the worker goes on with the next ingestion
+        logger.exception('Ingestion %s failed', ingestion.pk)
+        ingestion.finish(errors={'detail': str(e)})
+        return
+
+    serializer.notify(job)
+
+
+def run_worker(poll=POLL_INTERVAL, timeout=None, once=False):
+    """Ingest the queued jobs, waiting for new ones if the queue is
+    empty, or returning if once is True
+    """
+
+    timeout = ingestion_timeout if timeout is None else timeout
+
+    while True:
+        # as between requests, do not keep a broken or expired connection,
+        # a single pass may run inside a transaction
+        if not once:
+            close_old_connections()
+
+        ingestion = Ingestion.objects.claim(timeout, ingestion_max_attempts)
+
+        if ingestion is None:
+            if once:
+                return
+            time.sleep(poll)
+            continue
+
+        ingest(ingestion)
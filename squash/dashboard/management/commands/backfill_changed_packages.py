@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from dashboard.cache import invalidate
+from dashboard.models import Job, ChangedPackage
+
+
+class Command(BaseCommand):
+    """Compute the changed packages of existing jobs.
+
+    Jobs ingested through the API have their changed packages computed
+    at ingestion, this command recomputes them for every job in the
+    database walking each (ci_name, ci_dataset) lineage once in date order.
+    """
+
+    help = 'Recompute the packages that changed in each job'
+
+    def handle(self, *args, **options):
+
+        lineages = Job.objects.values_list('ci_name', 'ci_dataset').\
+            distinct()
+
+        n_jobs = 0
+
+        with transaction.atomic():
+            ChangedPackage.objects.all().delete()
+
+            for ci_name, ci_dataset in lineages:
+
+                jobs = Job.objects.filter(ci_name=ci_name,
+                                          ci_dataset=ci_dataset).\
+                    only('id', 'ci_id').order_by('date')
+
+                # packages of the last job seen, and of the last job seen
+                # with a different ci_id, reruns of a job are compared
+                # with the job before them
+                last_ci_id = None
+                last = None
+                previous = None
+
+                for job in jobs:
+                    current = job.get_package_set()
+
+                    if job.ci_id != last_ci_id:
+                        previous = last
+
+                    ChangedPackage.objects.create_for_job(job, current,
+                                                          previous)
+
+                    last_ci_id = job.ci_id
+                    last = current
+                    n_jobs += 1
+
+        invalidate(datasets=[ci_dataset for _, ci_dataset in lineages])
+
+        self.stdout.write('Changed packages computed for {} jobs'.format(
+            n_jobs))
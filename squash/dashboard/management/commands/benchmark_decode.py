@@ -0,0 +1,66 @@
+import json
+import random
+import time
+from ast import literal_eval
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    """Benchmark decoding of a large matchedDataset blob.
+
+    Compares the double literal_eval() previously used by the apps endpoint
+    to decode metadata and blobs stored as Python literals, with a single
+    json.loads() of the same data stored as JSON.
+    """
+
+    help = 'Compare blob decode time with literal_eval and json.loads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int,
+                            default=[1000, 10000, 100000],
+                            help='Number of matched stars')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Number of decodes for each size')
+
+    def make_matched_dataset(self, size):
+
+        columns = ('snr', 'mag', 'magerr', 'magrms', 'dist')
+
+        return {column: {'value': [random.random() for i in range(size)],
+                         'label': column, 'unit': ''}
+                for column in columns}
+
+    def time_decode(self, decode, text, repeat):
+
+        timings = []
+        for i in range(repeat):
+            start = time.time()
+            decode(text)
+            timings.append((time.time() - start) * 1000)
+
+        return min(timings)
+
+    def handle(self, *args, **options):
+
+        self.stdout.write('{:>8} {:>12} {:>16} {:>16}'.format(
+            'size', 'size (MB)', 'literal (ms)', 'json (ms)'))
+
+        for size in options['sizes']:
+            blob = [{'identifier': 'matchedDataset',
+                     'data': self.make_matched_dataset(size)}]
+
+            # as stored before, the JSON serialization of the string
+            # representation of the Python objects
+            literal = json.dumps(str(blob))
+            native = json.dumps(blob)
+
+            literal_time = self.time_decode(
+                lambda text: literal_eval(literal_eval(text)),
+                literal, options['repeat'])
+
+            json_time = self.time_decode(json.loads, native,
+                                         options['repeat'])
+
+            self.stdout.write('{:>8} {:>12.1f} {:>16.1f} {:>16.1f}'.format(
+                size, len(native) / 1e6, literal_time, json_time))
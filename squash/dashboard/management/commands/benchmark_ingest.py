@@ -0,0 +1,92 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from dashboard.models import Metric
+
+
+class Command(BaseCommand):
+    """Benchmark job ingestion through the jobs API endpoint.
+
+    Jobs of increasing size are posted to the API and the latency and
+    the number of queries per job are reported. Everything is done inside
+    a transaction that is rolled back at the end, so the database is left
+    untouched.
+    """
+
+    help = 'Record the per-job POST latency against job size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int,
+                            default=[10, 50, 100, 500],
+                            help='Number of packages and measurements '
+                                 'per job')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Number of jobs posted for each size')
+
+    def make_job(self, size, ci_id, metrics):
+
+        measurements = [{'metric': metrics[i % len(metrics)],
+                         'value': float(i), 'metadata': None}
+                        for i in range(size)]
+
+        packages = [{'name': 'package{}'.format(i),
+                     'git_url': 'https://github.com/lsst/package{}.git'
+                                .format(i),
+                     'git_commit': '{:040x}'.format(i),
+                     'git_branch': 'master',
+                     'build_version': 'b{}'.format(ci_id)}
+                    for i in range(size)]
+
+        return {'ci_id': str(ci_id), 'ci_name': 'benchmark',
+                'ci_dataset': 'benchmark', 'ci_label': 'centos-7',
+                'ci_url': 'https://ci.lsst.codes/job/benchmark/{}/'
+                          .format(ci_id),
+                'status': 0, 'measurements': measurements,
+                'packages': packages}
+
+    def handle(self, *args, **options):
+
+        url = reverse('job-list')
+
+        self.stdout.write('{:>8} {:>12} {:>12} {:>10}'.format(
+            'size', 'median (ms)', 'max (ms)', 'queries'))
+
+        with transaction.atomic():
+
+            user = User.objects.create_user('benchmark-ingest')
+            client = APIClient()
+            client.force_authenticate(user=user)
+
+            metrics = list(Metric.objects.values_list('metric', flat=True))
+            if not metrics:
+                Metric.objects.create(metric='benchmark',
+                                      description='Benchmark metric')
+                metrics = ['benchmark']
+
+            ci_id = 0
+            for size in options['sizes']:
+                latencies = []
+                for i in range(options['repeat']):
+                    ci_id += 1
+                    job = self.make_job(size, ci_id, metrics)
+
+                    with CaptureQueriesContext(connection) as queries:
+                        start = time.time()
+                        r = client.post(url, job, format='json')
+                        latencies.append((time.time() - start) * 1000)
+
+                    if r.status_code != 201:
+                        raise RuntimeError(r.content)
+
+                latencies.sort()
+                self.stdout.write('{:>8} {:>12.1f} {:>12.1f} {:>10}'.format(
+                    size, latencies[len(latencies)//2], latencies[-1],
+                    len(queries)))
+
+            transaction.set_rollback(True)
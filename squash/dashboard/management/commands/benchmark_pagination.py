@@ -0,0 +1,136 @@
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.core.urlresolvers import reverse
+from django.db import transaction
+from django.db.models import Max
+from rest_framework.test import APIClient
+
+from dashboard.models import Job, Metric, Measurement
+from dashboard.pagination import KeysetPagination
+
+
+class Command(BaseCommand):
+    """Benchmark the pages of the jobs and measurements endpoints.
+
+    Compares the latency of the first, middle and last pages requested
+    by page number, read with an offset and counted, and requested with
+    a cursor without the total count. Jobs and their measurements are
+    created inside a transaction that is rolled back at the end, so the
+    database is left untouched.
+
+    Measurements are ordered by the date of their job, a column of the
+    joined table that no index of the measurements serves. The database
+    still sorts the measurements after the cursor, deep pages of
+    measurements cost more than the first one.
+    """
+
+    help = 'Compare the latency of pages requested by number and by cursor'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int,
+                            default=[1000, 10000, 100000],
+                            help='Number of jobs')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Number of requests for each page')
+
+    def create_jobs(self, size, start, metric):
+
+        last = Job.objects.aggregate(last=Max('pk'))['last'] or 0
+
+        jobs = [Job(ci_id=str(i), ci_name='benchmark',
+                    ci_dataset='benchmark', ci_label='centos-7',
+                    ci_url='https://ci.lsst.codes/job/benchmark/{}/'.
+                    format(i))
+                for i in range(start, size)]
+
+        # jobs are registered with the current date, in creation order
+        Job.objects.bulk_create(jobs, batch_size=1000)
+
+        jobs = Job.objects.filter(pk__gt=last).values_list('pk', flat=True)
+
+        # one measurement of the metric per job
+        Measurement.objects.bulk_create(
+            [Measurement(job_id=pk, metric=metric, value=1.0)
+             for pk in jobs], batch_size=1000)
+
+    def time_request(self, client, url, params, repeat):
+
+        timings = []
+        for i in range(repeat):
+            # responses are not served from the cache
+            cache.clear()
+
+            start = time.time()
+            r = client.get(url, params)
+            timings.append((time.time() - start) * 1000)
+
+            if r.status_code != 200:
+                raise RuntimeError(r.content)
+
+        return min(timings)
+
+    def get_cursor(self, queryset, column, page, page_size):
+        """Cursor of a page, from the last row of the previous page"""
+
+        if page == 1:
+            return {}
+
+        row = queryset.order_by(column, 'pk')[(page - 1) * page_size - 1]
+
+        paginator = KeysetPagination()
+        paginator.column = column
+
+        return {'cursor': paginator.encode_cursor(
+            paginator.get_position(row), False)}
+
+    def handle(self, *args, **options):
+
+        client = APIClient()
+        page_size = 100
+
+        with transaction.atomic():
+
+            metric, _ = Metric.objects.get_or_create(
+                metric='benchmark', defaults={'description': 'benchmark'})
+
+            endpoints = [
+                ('jobs', reverse('job-list'),
+                 {'ci_dataset': 'benchmark', 'fields': 'ci_id,date'},
+                 Job.objects.filter(ci_dataset='benchmark'), 'date'),
+                ('measurements', reverse('measurements-list'),
+                 {'job__ci_dataset': 'benchmark', 'metric': metric.pk},
+                 Measurement.objects.filter(job__ci_dataset='benchmark',
+                                            metric=metric), 'job__date'),
+            ]
+
+            self.stdout.write('{:>12} {:>8} {:>8} {:>14} {:>14}'.format(
+                'endpoint', 'size', 'page', 'offset (ms)', 'cursor (ms)'))
+
+            created = 0
+            for size in sorted(options['sizes']):
+                self.create_jobs(size, created, metric)
+                created = size
+
+                last = -(-size // page_size)
+                pages = sorted(set([1, (last + 1) // 2, last]))
+
+                for name, url, params, queryset, column in endpoints:
+                    for page in pages:
+                        offset = self.time_request(
+                            client, url, dict(params, page=page),
+                            options['repeat'])
+
+                        cursor = self.get_cursor(queryset, column, page,
+                                                 page_size)
+                        cursor = self.time_request(
+                            client, url,
+                            dict(params, count='false', **cursor),
+                            options['repeat'])
+
+                        self.stdout.write(
+                            '{:>12} {:>8} {:>8} {:>14.1f} {:>14.1f}'.
+                            format(name, size, page, offset, cursor))
+
+            transaction.set_rollback(True)
@@ -0,0 +1,63 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from dashboard.stats import SnrIndex, get_statistics
+
+
+class Command(BaseCommand):
+    """Benchmark the statistics of a large matchedDataset for SNR cuts.
+
+    Compares the statistics computed by masking the full arrays for each
+    SNR cut, as done when the SNR slider of the apps moves, with the
+    statistics computed from an SNR index built once.
+    """
+
+    help = 'Compare SNR cut statistics with and without an SNR index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int,
+                            default=[10000, 100000, 1000000],
+                            help='Number of matched stars')
+        parser.add_argument('--cuts', type=int, default=20,
+                            help='Number of SNR cuts for each size')
+
+    def make_matched_dataset(self, size):
+
+        columns = ('snr', 'mag', 'magerr', 'magrms', 'dist')
+
+        return {column: {'value': [random.random() * 500
+                                   for i in range(size)],
+                         'label': column, 'unit': ''}
+                for column in columns}
+
+    def time_cuts(self, statistics, cuts):
+
+        start = time.time()
+        for snr_cut in cuts:
+            statistics(snr_cut)
+
+        return (time.time() - start) * 1000 / len(cuts)
+
+    def handle(self, *args, **options):
+
+        self.stdout.write('{:>8} {:>12} {:>12} {:>12}'.format(
+            'size', 'mask (ms)', 'build (ms)', 'index (ms)'))
+
+        for size in options['sizes']:
+            matched_dataset = self.make_matched_dataset(size)
+            cuts = [random.random() * 500 for i in range(options['cuts'])]
+
+            mask_time = self.time_cuts(
+                lambda snr_cut: get_statistics(matched_dataset, snr_cut),
+                cuts)
+
+            start = time.time()
+            index = SnrIndex(matched_dataset)
+            build_time = (time.time() - start) * 1000
+
+            index_time = self.time_cuts(index.get_statistics, cuts)
+
+            self.stdout.write('{:>8} {:>12.1f} {:>12.1f} {:>12.2f}'.format(
+                size, mask_time, build_time, index_time))
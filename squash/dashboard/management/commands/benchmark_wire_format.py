@@ -0,0 +1,94 @@
+import json
+import random
+import time
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from dashboard.renderers import NpzRenderer
+from dashboard.viz.api_helper import decode_npz
+
+
+class Command(BaseCommand):
+    """Benchmark the formats of the apps endpoint responses.
+
+    Compares the size, encode and decode times of a large matchedDataset
+    sent as JSON and in the binary columnar format. Decoding includes
+    the conversion done by the apps, a dataframe and one array per column.
+    """
+
+    help = 'Compare apps responses sent as JSON and as typed arrays'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int,
+                            default=[10000, 100000, 1000000],
+                            help='Number of matched stars')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Number of encodes and decodes for each size')
+
+    def make_matched_dataset(self, size):
+
+        columns = ('snr', 'mag', 'magerr', 'magrms', 'dist')
+
+        return {column: {'value': [random.random() for i in range(size)],
+                         'label': column, 'unit': ''}
+                for column in columns}
+
+    def time_call(self, func, arg, repeat):
+
+        timings = []
+        for i in range(repeat):
+            start = time.time()
+            func(arg)
+            timings.append((time.time() - start) * 1000)
+
+        return min(timings)
+
+    def to_dataframe(self, data):
+        """Convert the data as done by the apps"""
+
+        df = pd.DataFrame.from_dict(data, orient='index').transpose()
+
+        for column in df['matchedDataset'].dropna():
+            np.asarray(column['value'])
+
+        return df
+
+    def handle(self, *args, **options):
+
+        self.stdout.write('{:>8} {:>10} {:>10} {:>12} {:>12} {:>12} '
+                          '{:>12}'.format('size', 'json (MB)', 'npz (MB)',
+                                          'json enc', 'npz enc',
+                                          'json dec', 'npz dec'))
+
+        for size in options['sizes']:
+            data = {'metadata': {},
+                    'matchedDataset': self.make_matched_dataset(size)}
+
+            json_renderer = JSONRenderer()
+            npz_renderer = NpzRenderer()
+
+            json_content = json_renderer.render(data)
+            npz_content = npz_renderer.render(data)
+
+            json_encode = self.time_call(json_renderer.render, data,
+                                         options['repeat'])
+            npz_encode = self.time_call(npz_renderer.render, data,
+                                        options['repeat'])
+
+            json_decode = self.time_call(
+                lambda content: self.to_dataframe(
+                    json.loads(content.decode('utf-8'))),
+                json_content, options['repeat'])
+
+            npz_decode = self.time_call(
+                lambda content: self.to_dataframe(decode_npz(content)),
+                npz_content, options['repeat'])
+
+            self.stdout.write('{:>8} {:>10.1f} {:>10.1f} {:>12.1f} {:>12.1f} '
+                              '{:>12.1f} {:>12.1f}'.format(
+                                  size, len(json_content) / 1e6,
+                                  len(npz_content) / 1e6, json_encode,
+                                  npz_encode, json_decode, npz_decode))
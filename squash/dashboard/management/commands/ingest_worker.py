@@ -0,0 +1,79 @@
+import multiprocessing
+from multiprocessing.connection import wait
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from dashboard.ingestion import POLL_INTERVAL, async_ingestion, run_worker
+
+
+class Command(BaseCommand):
+    """Ingest the jobs queued by the jobs endpoint.
+
+    Starts a pool of worker processes, each one claims queued jobs from
+    the database, validates and writes them. A worker that dies, e.g.
+    out of memory, is replaced. Workers run until the command is
+    stopped, with --once the queued jobs are ingested by this process
+    and the command returns.
+
+    Nothing is started if ASYNC_INGESTION is off, jobs are then never
+    queued.
+    """
+
+    help = 'Ingest the jobs posted asynchronously to the jobs endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2,
+                            help='Number of worker processes')
+        parser.add_argument('--poll', type=float, default=POLL_INTERVAL,
+                            help='Seconds between checks of an empty queue')
+        parser.add_argument('--timeout', type=int, default=None,
+                            help='Seconds after which a job not ingested '
+                                 'by a stopped worker is claimed again')
+        parser.add_argument('--once', action='store_true',
+                            help='Ingest the queued jobs and exit')
+
+    def start_worker(self, options):
+
+        worker = multiprocessing.Process(target=run_worker,
+                                         args=(options['poll'],
+                                               options['timeout']),
+                                         daemon=True)
+        worker.start()
+
+        return worker
+
+    def handle(self, *args, **options):
+
+        if not async_ingestion:
+            self.stdout.write('Asynchronous ingestion is off, see '
+                              'ASYNC_INGESTION')
+            return
+
+        if options['once']:
+            run_worker(timeout=options['timeout'], once=True)
+            return
+
+        # worker processes open their own database connections
+        connections.close_all()
+
+        workers = [self.start_worker(options)
+                   for i in range(options['workers'])]
+
+        self.stdout.write('Started {} ingestion workers'.format(len(workers)))
+
+        try:
+            while True:
+                # wait for a worker to exit, workers only exit if they die
+                wait([worker.sentinel for worker in workers])
+
+                for i, worker in enumerate(workers):
+                    if not worker.is_alive():
+                        self.stderr.write('Ingestion worker {} exited with '
+                                          'code {}, starting a new one'.
+                                          format(worker.pid,
+                                                 worker.exitcode))
+                        workers[i] = self.start_worker(options)
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
@@ -0,0 +1,20 @@
+from django.core.urlresolvers import reverse
+from django.middleware.gzip import GZipMiddleware
+
+
+class ApiGZipMiddleware(GZipMiddleware):
+    """Compress the responses of the API endpoints.
+
+    HTML pages, e.g. the admin and the browsable API, are not compressed:
+    they hold CSRF tokens, which compression would expose to the BREACH
+    attack.
+    """
+
+    def process_response(self, request, response):
+
+        if not request.path.startswith(reverse('api-root')) or \
+                response.get('Content-Type', '').startswith('text/html'):
+            return response
+
+        return super(ApiGZipMiddleware, self).process_response(request,
+                                                               response)
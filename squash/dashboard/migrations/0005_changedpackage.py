@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0004_auto_20170216_0009'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangedPackage',
+            fields=[
+                ('id', models.AutoField(serialize=False, auto_created=True, verbose_name='ID', primary_key=True)),
+                ('name', models.SlugField(max_length=64, help_text='EUPS package name')),
+                ('git_url', models.URLField(max_length=128, help_text='Git repo URL for package')),
+                ('git_commit', models.CharField(max_length=40, help_text='SHA1 hash of the git commit')),
+                ('job', models.ForeignKey(related_name='changed_packages', to='dashboard.Job')),
+            ],
+        ),
+    ]
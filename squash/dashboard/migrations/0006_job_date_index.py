@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0005_changedpackage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='date',
+            field=models.DateTimeField(help_text='Datetime when job was registered', auto_now=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+import json
+from ast import literal_eval
+
+from django.db import models, migrations
+
+
+def decode(value):
+    """Blobs were stored as the JSON serialization of the string
+    representation of Python objects
+    """
+    while isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            try:
+                value = literal_eval(value)
+            except (ValueError, SyntaxError):
+                break
+    return value
+
+
+def move_blobs(apps, schema_editor):
+    """Move job blobs to the content-addressed blob store"""
+
+    Job = apps.get_model('dashboard', 'Job')
+    Blob = apps.get_model('dashboard', 'Blob')
+    JobBlob = apps.get_model('dashboard', 'JobBlob')
+
+    # the raw JSON text is read, to avoid decoding it with the
+    # field decoder
+    jobs = Job.objects.exclude(blobs=None).values_list('id', 'blobs')
+
+    for job_id, blobs in jobs.iterator():
+        blobs = decode(blobs)
+        if not isinstance(blobs, list):
+            continue
+
+        for blob in blobs:
+            content = json.dumps(blob['data'], sort_keys=True,
+                                 separators=(',', ':'))
+            sha256 = hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+            if not Blob.objects.filter(sha256=sha256).exists():
+                Blob.objects.create(sha256=sha256, data=content)
+
+            JobBlob.objects.create(job_id=job_id,
+                                   identifier=blob['identifier'],
+                                   name=blob.get('name', ''),
+                                   blob_id=sha256)
+
+
+def restore_blobs(apps, schema_editor):
+    """Move blobs back into the job rows"""
+
+    Job = apps.get_model('dashboard', 'Job')
+    JobBlob = apps.get_model('dashboard', 'JobBlob')
+
+    blobs = {}
+    for ref in JobBlob.objects.select_related('blob').iterator():
+        blobs.setdefault(ref.job_id, []).append(
+            {'identifier': ref.identifier, 'name': ref.name,
+             'data': json.loads(ref.blob.data)})
+
+    for job_id in blobs:
+        Job.objects.filter(pk=job_id).update(blobs=blobs[job_id])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0007_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('sha256', models.CharField(serialize=False, max_length=64, primary_key=True, help_text='SHA256 hash of the blob data')),
+                ('data', models.TextField(help_text='Blob data serialized as JSON')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='JobBlob',
+            fields=[
+                ('id', models.AutoField(serialize=False, auto_created=True, verbose_name='ID', primary_key=True)),
+                ('identifier', models.CharField(max_length=64, help_text='Blob identifier assigned by the job')),
+                ('name', models.CharField(max_length=64, blank=True, default='', help_text='Blob name, e.g. matchedDataset')),
+                ('blob', models.ForeignKey(related_name='job_blobs', to='dashboard.Blob')),
+                ('job', models.ForeignKey(related_name='job_blobs', to='dashboard.Job')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='jobblob',
+            index_together=set([('job', 'identifier')]),
+        ),
+        migrations.RunPython(move_blobs, restore_blobs),
+        migrations.RemoveField(
+            model_name='job',
+            name='blobs',
+        ),
+    ]
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+from ast import literal_eval
+
+from django.db import migrations
+
+
+def decode(value):
+    """Metadata was stored as the JSON serialization of the string
+    representation of Python objects
+    """
+    while isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            try:
+                value = literal_eval(value)
+            except (ValueError, SyntaxError):
+                break
+    return value
+
+
+def rewrite_metadata(apps, schema_editor):
+    """Rewrite measurement metadata stored as Python literals as JSON"""
+
+    Measurement = apps.get_model('dashboard', 'Measurement')
+
+    # the raw JSON text is read, to avoid decoding it with the
+    # field decoder
+    rows = Measurement.objects.exclude(metadata=None).\
+        values_list('id', 'metadata')
+
+    for pk, metadata in rows.iterator():
+        value = decode(metadata)
+        if value != json.loads(metadata):
+            Measurement.objects.filter(pk=pk).update(metadata=value)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0008_blob_store'),
+    ]
+
+    operations = [
+        migrations.RunPython(rewrite_metadata, migrations.RunPython.noop),
+    ]
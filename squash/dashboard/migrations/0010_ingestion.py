@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+import json_field.fields
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0009_metadata_json'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ingestion',
+            fields=[
+                ('id', models.AutoField(serialize=False, auto_created=True, verbose_name='ID', primary_key=True)),
+                ('status', models.CharField(max_length=8, choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', db_index=True, help_text='Ingestion status')),
+                ('created', models.DateTimeField(auto_now_add=True, help_text='Datetime when the job was posted')),
+                ('updated', models.DateTimeField(auto_now=True, help_text='Datetime of the last status change')),
+                ('payload', models.BinaryField(null=True, help_text='Job payload as posted')),
+                ('errors', json_field.fields.JSONField(null=True, blank=True, default=None, help_text='Errors if the ingestion failed')),
+                ('job', models.ForeignKey(related_name='ingestions', null=True, blank=True, on_delete=django.db.models.deletion.SET_NULL, to='dashboard.Job')),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0010_ingestion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestion',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0, help_text='Number of times the ingestion was claimed'),
+        ),
+    ]
@@ -1,7 +1,16 @@
+import hashlib
 import json
-from django.db import models
+from datetime import timedelta
+
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
 from json_field import JSONField
 
+from .cache import invalidate
+
 
 class Job(models.Model):
     """Job information"""
@@ -17,18 +26,40 @@ class Job(models.Model):
                                   help_text='Name of the dataset, e.g cfht')
     ci_label = models.CharField(max_length=16, blank=False,
                                 help_text='Name of the platform, eg. centos-7')
-    date = models.DateTimeField(auto_now=True,
+    date = models.DateTimeField(auto_now=True, db_index=True,
                                 help_text='Datetime when job was registered')
     ci_url = models.URLField(null=False, help_text='Jenkins job URL')
     status = models.SmallIntegerField(default=STATUS_OK,
                                       help_text='Job status, 0=OK, 1=Failed')
-    blobs = JSONField(null=True, blank=True, default=None,
-                      help_text='Data blobs produced by the job.',
-                      decoder=None)
+
+    class Meta:
+        # jobs are listed by dataset in date order by the monitor app and
+        # looked up by ci_id and dataset by the diagnostic apps
+        index_together = [('ci_dataset', 'date'), ('ci_id', 'ci_dataset')]
 
     def __str__(self):
         return self.ci_id
 
+    def get_previous(self):
+        """Return the previous job of the same Jenkins project and
+        dataset, skipping reruns of this job, or None if there is none.
+        """
+
+        # jobs are sorted by date because ci_id is a char
+        previous = Job.objects.filter(ci_name=self.ci_name,
+                                      ci_dataset=self.ci_dataset,
+                                      date__lt=self.date).\
+            exclude(ci_id=self.ci_id).order_by('-date')
+
+        return previous.first()
+
+    def get_package_set(self):
+        """Return the set of (name, git_commit, git_url) of the packages
+        used in this job.
+        """
+        return set(self.packages.values_list('name', 'git_commit',
+                                             'git_url'))
+
 
 class VersionedPackage(models.Model):
     """A specific version of an Eups Product used in a Job."""
@@ -48,6 +79,9 @@ class VersionedPackage(models.Model):
 
     job = models.ForeignKey(Job, null=False, related_name='packages')
 
+    class Meta:
+        index_together = [('job', 'name')]
+
     def __str__(self):
         return json.dumps({'_class': 'VersionedPackage',
                            'job.ci_id': self.job.ci_id,
@@ -59,6 +93,170 @@ class VersionedPackage(models.Model):
                           indent=2, sort_keys=True)
 
 
+class BlobManager(models.Manager):
+
+    def store(self, data):
+        """Store data in the blob store and return the hash that identifies
+        it, identical data is stored only once.
+        """
+
+        content = json.dumps(data, sort_keys=True, separators=(',', ':'))
+        sha256 = hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+        if not self.filter(sha256=sha256).exists():
+            try:
+                with transaction.atomic():
+                    self.create(sha256=sha256, data=content)
+            except IntegrityError:
+                # the same blob was stored concurrently by another job
+                pass
+
+        return sha256
+
+
+class Blob(models.Model):
+    """Content-addressed data blob, e.g. the matchedDataset produced by
+    validate_drp, keyed by the hash of its JSON serialization.
+    """
+    sha256 = models.CharField(max_length=64, primary_key=True,
+                              help_text='SHA256 hash of the blob data')
+    data = models.TextField(help_text='Blob data serialized as JSON')
+
+    objects = BlobManager()
+
+    def __str__(self):
+        return self.sha256
+
+    def load(self):
+        return json.loads(self.data)
+
+
+class JobBlob(models.Model):
+    """Reference from a Job to a data blob it produced."""
+    identifier = models.CharField(max_length=64, blank=False,
+                                  help_text='Blob identifier assigned by '
+                                            'the job')
+    name = models.CharField(max_length=64, blank=True, default='',
+                            help_text='Blob name, e.g. matchedDataset')
+
+    job = models.ForeignKey(Job, null=False, related_name='job_blobs')
+    blob = models.ForeignKey(Blob, null=False, related_name='job_blobs')
+
+    class Meta:
+        index_together = [('job', 'identifier')]
+
+    def __str__(self):
+        return self.identifier
+
+
+class ChangedPackageManager(models.Manager):
+
+    def create_for_job(self, job, current, previous=None):
+        """Store the packages that changed in a job.
+
+        Parameters
+        ----------
+        job : Job
+            the job the changed packages are assigned to
+        current : set
+            set of (name, git_commit, git_url) used in the job
+        previous : set or None
+            set of (name, git_commit, git_url) used in the previous job,
+            None if there is no previous job
+
+        We are assuming that deviations in the metric measurements
+        are caused by:
+
+        - new packages present in the current job but not present in the
+        previous one
+        - packages present in the current job and in the previous job that
+        changed (according to the git commit sha)
+        """
+
+        if previous is None:
+            # in case we dont have a previous job nothing changed
+            return []
+
+        return self.bulk_create(
+            [ChangedPackage(job=job, name=name, git_commit=git_commit,
+                            git_url=git_url)
+             for name, git_commit, git_url in sorted(current - previous)])
+
+
+class ChangedPackage(models.Model):
+    """A package that changed in a Job with respect to the previous Job of
+    the same Jenkins project and dataset, computed once at ingestion.
+    """
+    name = models.SlugField(
+        max_length=64, null=False,
+        help_text='EUPS package name')
+    git_url = models.URLField(
+        max_length=128,
+        help_text='Git repo URL for package')
+    git_commit = models.CharField(
+        max_length=40, null=False,
+        help_text='SHA1 hash of the git commit')
+
+    job = models.ForeignKey(Job, null=False, related_name='changed_packages')
+
+    objects = ChangedPackageManager()
+
+    def __str__(self):
+        return self.name
+
+
+class MetricManager(models.Manager):
+
+    def upsert(self, definitions):
+        """Create or update metrics from their definitions.
+
+        Parameters
+        ----------
+        definitions : list
+            list of dicts of field values, each with the metric name.
+            Fields not given keep their current value, or the default
+            value for new metrics.
+
+        Returns the names of the metrics created, updated and unchanged.
+        Existing metrics are read in one query and new metrics written in
+        batched inserts, only the metrics that changed are updated.
+        """
+
+        names = [definition['metric'] for definition in definitions]
+
+        created, updated, unchanged = [], [], []
+
+        with transaction.atomic():
+            existing = self.select_for_update().in_bulk(names)
+
+            for definition in definitions:
+                metric = existing.get(definition['metric'])
+
+                if metric is None:
+                    created.append(self.model(**definition))
+                    continue
+
+                changes = {field: value for field, value in definition.items()
+                           if getattr(metric, field) != value}
+
+                if changes:
+                    self.filter(pk=metric.pk).update(**changes)
+                    updated.append(metric.pk)
+                else:
+                    unchanged.append(metric.pk)
+
+            self.bulk_create(created)
+
+        created = [metric.pk for metric in created]
+
+        # signals are not sent by bulk writes, invalidate only the
+        # responses of the metrics written once they are committed
+        if created or updated:
+            invalidate(metrics=created + updated)
+
+        return created, updated, unchanged
+
+
 class Metric(models.Model):
     """Metric definition.
     """
@@ -81,6 +279,8 @@ class Metric(models.Model):
     reference = JSONField(null=True, blank=True, default=None,
                           help_text='Metric reference', decoder=None)
 
+    objects = MetricManager()
+
     def __str__(self):
         return self.metric
 
@@ -95,5 +295,134 @@ class Measurement(models.Model):
                          help_text='Measurement metadata',
                          decoder=None)
 
+    class Meta:
+        # measurements are listed by metric and dataset in job date order
+        index_together = [('metric', 'job')]
+
     def __float__(self):
         return self.value
+
+
+class IngestionManager(models.Manager):
+
+    def enqueue(self, payload):
+        """Queue the raw payload of a job posted to the jobs endpoint"""
+
+        return self.create(payload=payload)
+
+    def claim(self, timeout, max_attempts=3):
+        """Claim the oldest ingestion waiting for a worker and return it,
+        or None if there is none.
+
+        Ingestions running for more than timeout seconds are claimed
+        again, their worker was stopped. After max_attempts claims they
+        fail instead, e.g. their payload made the worker run out of
+        memory every time. An ingestion is claimed only if no other
+        worker claimed it since it was read, so concurrent workers never
+        claim the same one.
+        """
+
+        stale = timezone.now() - timedelta(seconds=timeout)
+
+        queued = Q(status=Ingestion.QUEUED)
+        stopped = Q(status=Ingestion.RUNNING, updated__lt=stale)
+        waiting = self.filter(queued | stopped)
+
+        for pk, status, updated, attempts in waiting.order_by('pk').\
+                values_list('pk', 'status', 'updated', 'attempts')[:10]:
+
+            unchanged = self.filter(pk=pk, status=status, updated=updated)
+
+            if attempts >= max_attempts:
+                unchanged.update(status=Ingestion.FAILED,
+                                 updated=timezone.now(),
+                                 errors={'detail': 'Worker stopped after {} '
+                                                   'attempts'.format(attempts)})
+                continue
+
+            claimed = unchanged.update(status=Ingestion.RUNNING,
+                                       updated=timezone.now(),
+                                       attempts=F('attempts') + 1)
+
+            if claimed:
+                return self.get(pk=pk)
+
+        return None
+
+
+class Ingestion(models.Model):
+    """A job posted to the jobs endpoint and ingested asynchronously by
+    the ingest_worker command. The raw payload is kept until the job is
+    written, the status tells the client the outcome.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = ((QUEUED, 'Queued'), (RUNNING, 'Running'),
+                      (DONE, 'Done'), (FAILED, 'Failed'))
+
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES,
+                              default=QUEUED, db_index=True,
+                              help_text='Ingestion status')
+    created = models.DateTimeField(auto_now_add=True,
+                                   help_text='Datetime when the job was '
+                                             'posted')
+    updated = models.DateTimeField(auto_now=True,
+                                   help_text='Datetime of the last status '
+                                             'change')
+    payload = models.BinaryField(null=True,
+                                 help_text='Job payload as posted')
+    errors = JSONField(null=True, blank=True, default=None,
+                       help_text='Errors if the ingestion failed',
+                       decoder=None)
+    attempts = models.PositiveIntegerField(default=0,
+                                           help_text='Number of times the '
+                                                     'ingestion was claimed')
+
+    job = models.ForeignKey(Job, null=True, blank=True,
+                            on_delete=models.SET_NULL,
+                            related_name='ingestions')
+
+    objects = IngestionManager()
+
+    def __str__(self):
+        return '{} {}'.format(self.pk, self.status)
+
+    def finish(self, job=None, errors=None):
+        """Record the job written, or the errors if it was not"""
+
+        self.status = self.FAILED if job is None else self.DONE
+        self.job = job
+        self.errors = errors
+
+        # payloads of failed ingestions are kept to find the cause
+        if job is not None:
+            self.payload = None
+
+        self.save(update_fields=['status', 'job', 'errors', 'payload',
+                                 'updated'])
+
+
+# Cached API responses depend on the dataset of the jobs and measurements
+# written, and on the definition of the metrics. A measurement belongs to
+# the dataset of its job, so writing it leaves the responses of the other
+# datasets valid. bulk_create() does not send these signals, bulk writes
+# invalidate the cache explicitly.
+
+@receiver([post_save, post_delete], sender=Job)
+def invalidate_job(sender, instance, **kwargs):
+    invalidate(datasets=[instance.ci_dataset])
+
+
+@receiver([post_save, post_delete], sender=Measurement)
+def invalidate_measurement(sender, instance, **kwargs):
+    # jobs loaded from fixtures invalidate their own dataset
+    if not kwargs.get('raw'):
+        invalidate(datasets=[instance.job.ci_dataset])
+
+
+@receiver([post_save, post_delete], sender=Metric)
+def invalidate_metric(sender, instance, **kwargs):
+    invalidate(metrics=[instance.metric])
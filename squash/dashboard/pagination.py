@@ -0,0 +1,191 @@
+"""Pagination of the jobs and measurements endpoints"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.template import Context, loader
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(PageNumberPagination):
+    """Pages of results ordered by a column and the primary key.
+
+    Pages are linked by cursors holding the column and primary key of the
+    last row of the page, or of the first row for the previous page. The
+    next page is found with the index on the column, the database does
+    not read and discard the rows of the pages before it, so any page
+    costs the same as the first one.
+
+    The column is the first one the queryset is ordered by, e.g. the job
+    date. The total number of results is returned unless the count=false
+    query parameter is given.
+
+    Pages requested by number with the page query parameter are still
+    served, for the existing clients.
+    """
+
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor.'
+    cursor_template = 'rest_framework/pagination/previous_and_next.html'
+
+    def get_ordering(self, queryset):
+        """Return the column ordering the queryset and if the order is
+        descending
+        """
+
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        column = ordering[0] if ordering else 'pk'
+
+        return column.lstrip('-'), column.startswith('-')
+
+    def get_position(self, instance):
+        """Return the column and primary key of a row"""
+
+        value = instance
+        for name in self.column.split('__'):
+            value = getattr(value, name)
+
+        return [str(value), instance.pk]
+
+    def encode_cursor(self, position, reverse):
+
+        cursor = json.dumps({'p': position, 'r': reverse})
+        return urlsafe_b64encode(cursor.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, encoded):
+
+        try:
+            cursor = json.loads(
+                urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            value, pk = cursor['p']
+            return [value, int(pk)], bool(cursor['r'])
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_queryset(self, queryset, request, view=None):
+
+        self.column, descending = self.get_ordering(queryset)
+
+        # the primary key orders the rows with the same value, so that
+        # pages are the same whichever way they are requested
+        ordering = [self.column, 'pk']
+
+        params = request.query_params
+        self.is_cursor = self.page_query_param not in params
+
+        if not self.is_cursor:
+            if descending:
+                ordering = ['-' + name for name in ordering]
+            return super(KeysetPagination, self).paginate_queryset(
+                queryset.order_by(*ordering), request, view)
+
+        self._handle_backwards_compat(view)
+
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+
+        self.count = None
+        if params.get(self.count_query_param, '').lower() not in ('false', '0'):
+            self.count = queryset.count()
+
+        position, reverse = None, False
+        if self.cursor_query_param in params:
+            position, reverse = self.decode_cursor(
+                params[self.cursor_query_param])
+
+        # previous pages are read backwards from their cursor
+        if descending != reverse:
+            ordering = ['-' + name for name in ordering]
+        queryset = queryset.order_by(*ordering)
+
+        if position is not None:
+            value, pk = position
+
+            # rows after the cursor in the order they are read
+            lookup = 'gt' if descending == reverse else 'lt'
+            after = Q(**{'{}__{}'.format(self.column, lookup): value})
+            tied = Q(**{self.column: value, 'pk__' + lookup: pk})
+
+            # the range on the column alone lets the database use its index
+            bound = 'gte' if lookup == 'gt' else 'lte'
+            queryset = queryset.\
+                filter(**{'{}__{}'.format(self.column, bound): value}).\
+                filter(after | tied)
+
+        # an extra row tells if there are more rows after the page
+        rows = list(queryset[:page_size + 1])
+        self.page = rows[:page_size]
+        more = len(rows) > page_size
+
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, more
+        else:
+            self.has_next, self.has_previous = more, position is not None
+
+        if self.has_next or self.has_previous:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_paginated_response(self, data):
+
+        if not self.is_cursor:
+            return super(KeysetPagination, self).get_paginated_response(data)
+
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+
+        return Response(response)
+
+    def get_cursor_link(self, instance, reverse):
+
+        cursor = self.encode_cursor(self.get_position(instance), reverse)
+
+        return replace_query_param(self.base_url, self.cursor_query_param,
+                                   cursor)
+
+    def get_next_link(self):
+
+        if not self.is_cursor:
+            return super(KeysetPagination, self).get_next_link()
+
+        if not self.has_next or not self.page:
+            return None
+
+        return self.get_cursor_link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+
+        if not self.is_cursor:
+            return super(KeysetPagination, self).get_previous_link()
+
+        if not self.has_previous or not self.page:
+            return None
+
+        return self.get_cursor_link(self.page[0], reverse=True)
+
+    def to_html(self):
+
+        if not self.is_cursor:
+            return super(KeysetPagination, self).to_html()
+
+        template = loader.get_template(self.cursor_template)
+        context = Context({'previous_url': self.get_previous_link(),
+                           'next_url': self.get_next_link()})
+
+        return template.render(context)
@@ -0,0 +1,183 @@
+"""Formats of the API responses consumed by the bokeh apps.
+
+JSON responses of these endpoints are streamed, their text is generated
+in chunks while it is sent, see streaming_response().
+
+Responses are also sent as a numpy .npz archive when the client accepts
+application/x-npz. Lists of numbers become typed arrays of the archive,
+the rest of the response is a JSON document stored in the archive where
+each array is replaced by {"__array__": name}. Clients load the arrays
+without parsing them, see decode_npz() in viz/api_helper.py.
+"""
+import io
+import json
+
+import numpy as np
+from django.http import StreamingHttpResponse
+from rest_framework.compat import SHORT_SEPARATORS, LONG_SEPARATORS
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+NPZ_MEDIA_TYPE = 'application/x-npz'
+
+# Number of list items encoded at once, and approximate size in bytes of
+# the chunks of a streaming response
+STREAM_ITEMS = 1000
+STREAM_CHUNK_SIZE = 65536
+
+# Name of the array holding the JSON document in the archive
+DOCUMENT = 'document'
+
+# Key of the objects replacing the arrays in the JSON document
+ARRAY_KEY = '__array__'
+
+
+def to_array(value):
+    """Return a list of numbers as an array, or None if it holds
+    anything else
+    """
+
+    if not value:
+        return None
+
+    try:
+        array = np.asarray(value)
+    except (ValueError, OverflowError):
+        return None
+
+    if array.ndim != 1 or array.dtype.kind not in 'iuf':
+        return None
+
+    return array
+
+
+def encode_npz(data):
+    """Return data in the binary columnar format"""
+
+    arrays = {}
+
+    def extract(value):
+        if isinstance(value, dict):
+            return {key: extract(item) for key, item in value.items()}
+
+        if isinstance(value, (list, tuple)):
+            array = to_array(value)
+            if array is None:
+                return [extract(item) for item in value]
+
+            name = str(len(arrays))
+            arrays[name] = array
+            return {ARRAY_KEY: name}
+
+        return value
+
+    document = json.dumps(extract(data), cls=JSONEncoder).encode('utf-8')
+    arrays[DOCUMENT] = np.frombuffer(document, dtype=np.uint8)
+
+    content = io.BytesIO()
+    np.savez(content, **arrays)
+
+    return content.getvalue()
+
+
+class NpzRenderer(BaseRenderer):
+    """Renders responses in the binary columnar format"""
+
+    media_type = NPZ_MEDIA_TYPE
+    format = 'npz'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+
+        if data is None:
+            return bytes()
+
+        return encode_npz(data)
+
+
+# Renderers of the endpoints serving columns of numbers, JSON remains
+# the default
+COLUMNAR_RENDERER_CLASSES = api_settings.DEFAULT_RENDERER_CLASSES + \
+    [NpzRenderer]
+
+
+def iter_json(data, encode, items=STREAM_ITEMS):
+    """Generate the JSON text of data in pieces, lists are encoded at most
+    items at a time
+    """
+
+    if isinstance(data, dict):
+        yield '{'
+        for i, (key, value) in enumerate(data.items()):
+            if i > 0:
+                yield ','
+            yield encode(str(key))
+            yield ':'
+            for piece in iter_json(value, encode, items):
+                yield piece
+        yield '}'
+
+    elif isinstance(data, (list, tuple)):
+        yield '['
+        for start in range(0, len(data), items):
+            if start > 0:
+                yield ','
+            # strip the brackets of the encoded slice
+            yield encode(list(data[start:start + items]))[1:-1]
+        yield ']'
+
+    else:
+        yield encode(data)
+
+
+def stream_json(data, renderer=None, chunk_size=STREAM_CHUNK_SIZE):
+    """Generate the JSON text of data as rendered by a JSON renderer, in
+    chunks of about chunk_size bytes.
+
+    Only a chunk of the text is in memory at a time, whatever the size
+    of data.
+    """
+
+    renderer = renderer or JSONRenderer()
+
+    separators = SHORT_SEPARATORS if renderer.compact else LONG_SEPARATORS
+    encode = renderer.encoder_class(ensure_ascii=renderer.ensure_ascii,
+                                    separators=separators).encode
+
+    def join(pieces):
+        # as JSONRenderer, the output is a strict javascript subset
+        return ''.join(pieces).replace('\u2028', '\\u2028').\
+            replace('\u2029', '\\u2029').encode('utf-8')
+
+    pieces = []
+    size = 0
+
+    for piece in iter_json(data, encode):
+        pieces.append(piece)
+        size += len(piece)
+
+        if size >= chunk_size:
+            yield join(pieces)
+            pieces = []
+            size = 0
+
+    yield join(pieces)
+
+
+def streaming_response(request, data):
+    """Return a response with data, JSON is streamed and compressed by
+    GZipMiddleware as it is generated. Other formats, and JSON requested
+    with indentation, are rendered at once.
+    """
+
+    renderer = request.accepted_renderer
+
+    if not isinstance(renderer, JSONRenderer) or \
+            'indent' in request.accepted_media_type:
+        return Response(data)
+
+    return StreamingHttpResponse(stream_json(data, renderer),
+                                 content_type=renderer.media_type)
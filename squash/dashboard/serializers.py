@@ -1,8 +1,93 @@
+import json
+from ast import literal_eval
+
 from rest_framework import serializers
 from rest_framework.reverse import reverse
-from .models import Job, Metric, Measurement, VersionedPackage
+from .models import Job, Metric, Measurement, VersionedPackage, \
+    ChangedPackage, Blob, JobBlob, Ingestion
+from .cache import invalidate
+from .events import publish
+from django.conf import settings
 from django.db import transaction
 
+try:
+    bulk_create_batch_size = settings.BULK_CREATE_BATCH_SIZE
+except AttributeError:
+    # if not specified let the database backend choose the batch size
+    bulk_create_batch_size = None
+
+
+def decode_json(value):
+    """Decode a value sent as JSON text, older clients send
+    the string representation of Python objects instead
+    """
+
+    while isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            try:
+                value = literal_eval(value)
+            except (ValueError, SyntaxError):
+                break
+
+    return value
+
+
+class BlobsField(serializers.Field):
+    """Data blobs produced by a job, a list of objects with identifier,
+    name and data. Blobs are moved to the blob store on ingestion and only
+    loaded by the apps endpoint, so this field is write only.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['write_only'] = True
+        super(BlobsField, self).__init__(**kwargs)
+
+    def to_internal_value(self, data):
+
+        blobs = decode_json(data)
+
+        if blobs is None:
+            return []
+
+        def is_blob(blob):
+            return isinstance(blob, dict) and \
+                'identifier' in blob and 'data' in blob
+
+        if not isinstance(blobs, list) or not all(map(is_blob, blobs)):
+            raise serializers.ValidationError(
+                'Expected a list of blobs with identifier and data.')
+
+        return blobs
+
+
+class JSONValueField(serializers.Field):
+    """A value stored in a JSON field, sent as a JSON value or, by older
+    clients, as text
+    """
+
+    def to_internal_value(self, data):
+        return decode_json(data)
+
+    def to_representation(self, value):
+        return value
+
+
+class SparseFieldsSerializerMixin(object):
+    """Serializer mixin taking the names of the fields to serialize in the
+    fields keyword argument, the other fields are dropped
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+
+        super(SparseFieldsSerializerMixin, self).__init__(*args, **kwargs)
+
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
 
 class MetricSerializer(serializers.ModelSerializer):
     """Serializer for `models.Metric` objects.
@@ -31,6 +116,51 @@ class MetricSerializer(serializers.ModelSerializer):
         return data
 
 
+class MetricUpsertSerializer(serializers.ModelSerializer):
+    """Serializer for the metric definitions of a bulk upsert, see
+    MetricManager.upsert. Definitions are validated before any of them is
+    written.
+    """
+
+    # metrics may already exist, so their names are not validated as
+    # unique
+    metric = serializers.CharField(max_length=16)
+
+    parameters = JSONValueField(required=False, allow_null=True)
+    specs = JSONValueField(required=False, allow_null=True)
+    reference = JSONValueField(required=False, allow_null=True)
+
+    class Meta:
+        model = Metric
+        fields = ('metric', 'unit', 'description', 'operator',
+                  'parameters', 'specs', 'reference')
+
+    def validate_parameters(self, value):
+
+        if value is not None and not isinstance(value, dict):
+            raise serializers.ValidationError(
+                'Expected an object of parameters.')
+
+        return value
+
+    def validate_specs(self, value):
+
+        if value is None:
+            return value
+
+        def is_spec(spec):
+            return isinstance(spec, dict) and \
+                isinstance(spec.get('name'), str) and \
+                isinstance(spec.get('value'), (int, float)) and \
+                not isinstance(spec.get('value'), bool)
+
+        if not isinstance(value, list) or not all(map(is_spec, value)):
+            raise serializers.ValidationError(
+                'Expected a list of specs with name and value.')
+
+        return value
+
+
 class MeasurementSerializer(serializers.ModelSerializer):
     """Serializer for `models.Measurement` objects.
 
@@ -42,6 +172,11 @@ class MeasurementSerializer(serializers.ModelSerializer):
         model = Measurement
         fields = ('metric', 'value', 'metadata',)
 
+    def validate_metadata(self, value):
+        # metadata is stored as JSON, so that it is parsed
+        # once when read by the apps endpoint
+        return decode_json(value)
+
 
 class RegressionSerializer(serializers.ModelSerializer):
     """Serializer for the measurements endpoint consumed
@@ -80,39 +215,12 @@ class RegressionSerializer(serializers.ModelSerializer):
     def get_date(self, obj):
         return obj.job.date
 
-    # get the different in packages from current and previous jobs
+    # the difference in packages from current and previous jobs is
+    # computed at ingestion, see ChangedPackageManager.create_for_job
     def get_changed_packages(self, obj):
 
-        current = set()
-        for pkg in VersionedPackage.objects.filter(job=obj.job):
-            current.add((pkg.name, pkg.git_commit, pkg.git_url))
-
-        try:
-            # jobs are sorted by date because ci_id is a char
-            previous_job = obj.job.get_previous_by_date()
-
-            # make sure previous is not the current ci_id
-            while obj.job.ci_id == previous_job.ci_id:
-                previous_job = previous_job.get_previous_by_date()
-
-        except:
-            # in case we dont have a previous job
-            previous_job = obj.job
-
-        previous = set()
-        for pkg in VersionedPackage.objects.filter(job=previous_job):
-            previous.add((pkg.name, pkg.git_commit, pkg.git_url))
-
-        # We are assuming that deviations in the metric measurements
-        # are caused by:
-        #
-        # - new packages present in the current job but not present in the
-        # previous one
-        # - packages present in the previous job but removed in the current one
-        # - packages present in the current job and in the previous job that
-        # changed (according to the git commit sha)
-
-        return current.difference(previous)
+        return [(pkg.name, pkg.git_commit, pkg.git_url)
+                for pkg in obj.job.changed_packages.all()]
 
 
 class VersionedPackageSerializer(serializers.ModelSerializer):
@@ -129,12 +237,14 @@ class VersionedPackageSerializer(serializers.ModelSerializer):
                   'build_version')
 
 
-class JobSerializer(serializers.ModelSerializer):
+class JobSerializer(SparseFieldsSerializerMixin,
+                    serializers.ModelSerializer):
 
     links = serializers.SerializerMethodField()
 
     measurements = MeasurementSerializer(many=True)
     packages = VersionedPackageSerializer(many=True)
+    blobs = BlobsField(required=False, allow_null=True)
 
     class Meta:
         model = Job
@@ -144,20 +254,72 @@ class JobSerializer(serializers.ModelSerializer):
 
     # Override the create method to create nested objects from request data
     def create(self, data):
-        measurements = data.pop('measurements')
-        packages = data.pop('packages')
 
         # Use transactions, so that if one of the measurement objects isn't
         # valid that we will rollback even the parent Job object creation
         with transaction.atomic():
-            job = Job.objects.create(**data)
-            for measurement in measurements:
-                Measurement.objects.create(job=job, **measurement)
-            for package in packages:
-                VersionedPackage.objects.create(job=job, **package)
+            job = self.write(data)
+
+        self.notify(job)
 
         return job
 
+    def write(self, data):
+        """Write the job and its nested objects, the caller runs it in a
+        transaction and calls notify() once it is committed
+        """
+        measurements = data.pop('measurements')
+        packages = data.pop('packages')
+        blobs = data.pop('blobs', None) or []
+
+        job = Job.objects.create(**data)
+
+        # Nested objects are written in batched inserts, so the number
+        # of round trips does not grow with the size of the job
+        Measurement.objects.bulk_create(
+            [Measurement(job=job, **measurement)
+             for measurement in measurements],
+            batch_size=bulk_create_batch_size)
+
+        VersionedPackage.objects.bulk_create(
+            [VersionedPackage(job=job, **package)
+             for package in packages],
+            batch_size=bulk_create_batch_size)
+
+        previous = job.get_previous()
+        if previous is not None:
+            previous = previous.get_package_set()
+
+        current = set((package['name'], package['git_commit'],
+                       package['git_url']) for package in packages)
+
+        ChangedPackage.objects.create_for_job(job, current, previous)
+
+        # Blobs are deduplicated in the blob store, the job keeps
+        # only references to them
+        JobBlob.objects.bulk_create(
+            [JobBlob(job=job, identifier=blob['identifier'],
+                     name=blob.get('name', ''),
+                     blob_id=Blob.objects.store(blob['data']))
+             for blob in blobs])
+
+        return job
+
+    def notify(self, job):
+        """Invalidate the cached responses and notify the bokeh sessions of
+        a job written by write()
+        """
+        measurements = self.validated_data['measurements']
+
+        # Invalidate only after the transaction is committed, otherwise
+        # a concurrent read could cache a response without the new job.
+        # Responses of the other datasets are still valid.
+        invalidate(datasets=[job.ci_dataset])
+
+        # notify the bokeh sessions showing the dataset and metrics
+        metrics = [measurement['metric'].pk for measurement in measurements]
+        publish(job.ci_dataset, metrics, job.pk)
+
     def get_links(self, obj):
 
         request = self.context['request']
@@ -165,3 +327,30 @@ class JobSerializer(serializers.ModelSerializer):
             'self': reverse('job-detail', kwargs={'pk': obj.pk},
                             request=request),
         }
+
+
+class IngestionSerializer(serializers.ModelSerializer):
+    """Serializer for the status of `models.Ingestion` objects, the
+    payload is not returned.
+    """
+
+    links = serializers.SerializerMethodField()
+
+    errors = JSONValueField(read_only=True)
+
+    class Meta:
+        model = Ingestion
+        fields = ('id', 'status', 'created', 'updated', 'errors', 'links')
+
+    def get_links(self, obj):
+
+        request = self.context['request']
+
+        job = None
+        if obj.job_id is not None:
+            job = reverse('job-detail', kwargs={'pk': obj.job_id},
+                          request=request)
+
+        return {'self': reverse('ingestion-detail', kwargs={'pk': obj.pk},
+                                request=request),
+                'job': job}
@@ -0,0 +1,306 @@
+"""Statistics and sampling of the matched dataset shown by the
+diagnostic apps.
+
+The apps plot a sample of the matched stars, the statistics and
+histograms are computed here on the full dataset so that they are
+exact whatever the size of the sample.
+"""
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+
+from .models import Blob
+
+# Number of bins of the histograms shown by the apps
+HISTOGRAM_BINS = 100
+
+try:
+    snr_index_cache_size = settings.SNR_INDEX_CACHE_SIZE
+except AttributeError:
+    snr_index_cache_size = 8
+
+
+def get_columns(matched_dataset):
+    """Return the numeric columns of a matched dataset as arrays, columns
+    are stored as {'value': [...], 'label': ..., 'unit': ...}
+    """
+
+    columns = {}
+
+    for name, column in matched_dataset.items():
+        if isinstance(column, dict) and 'value' in column:
+            try:
+                columns[name] = np.asarray(column['value'], dtype=float)
+            except (TypeError, ValueError):
+                continue
+
+    return columns
+
+
+def downsample(matched_dataset, max_points, seed=0):
+    """Return a matched dataset with at most max_points stars.
+
+    Stars are drawn uniformly at random, so that the density of points in
+    the plots is preserved. The seed is fixed so that every request gets
+    the same sample.
+    """
+
+    columns = get_columns(matched_dataset)
+    sizes = set(values.size for values in columns.values())
+
+    if len(sizes) != 1:
+        return matched_dataset
+
+    size = sizes.pop()
+
+    if size <= max_points:
+        return matched_dataset
+
+    index = np.sort(np.random.RandomState(seed).choice(size, max_points,
+                                                       replace=False))
+
+    sample = dict(matched_dataset)
+    for name, values in columns.items():
+        sample[name] = dict(matched_dataset[name],
+                            value=values[index].tolist())
+
+    return sample
+
+
+def summarize(selected, edges):
+    """Return the statistics of the selected values of a column, and
+    the histogram of the selected values
+    """
+
+    n = int(selected.size)
+
+    counts, _ = np.histogram(selected, bins=edges)
+
+    if n == 0:
+        return {'n': 0, 'median': None, 'rms': None, 'min': None,
+                'max': None, 'selected': counts.tolist()}
+
+    return {'n': n,
+            'median': float(np.median(selected)),
+            'rms': float(np.sqrt(np.mean(np.square(selected)))),
+            'min': float(selected.min()),
+            'max': float(selected.max()),
+            'selected': counts.tolist()}
+
+
+def get_statistics(matched_dataset, snr_cut, bins=HISTOGRAM_BINS):
+    """Return the statistics of each column of a matched dataset, for the
+    stars with snr greater than snr_cut.
+
+    For each column the number of stars and the histogram of the full
+    dataset are returned together with the number of stars, the median,
+    rms, minimum, maximum and histogram of the selected stars. Histograms
+    of the full and selected stars have the same bin edges.
+    """
+
+    columns = get_columns(matched_dataset)
+
+    if 'snr' not in columns:
+        return {}
+
+    index = columns['snr'] > snr_cut
+
+    statistics = {}
+
+    for name, values in columns.items():
+        counts, edges = np.histogram(values, bins=bins)
+
+        statistics[name] = dict(summarize(values[index], edges),
+                                size=int(values.size),
+                                full=counts.tolist(),
+                                edges=edges.tolist())
+
+    return statistics
+
+
+class ColumnIndex(object):
+    """Statistics of the values of a column after any position.
+
+    Values are given in snr order, the stars selected by an SNR cut are
+    the values after a position. Histograms of the values after every
+    step-th position are accumulated, the histogram after any position
+    is then the nearest accumulated histogram plus the counts of at most
+    step values. Sums of squares, minimum and maximum are accumulated for
+    every position.
+
+    For the median, values are also grouped in blocks of equal size by
+    value, counted in the same way. The k-th smallest value after a
+    position is found in the block where the cumulative count reaches k,
+    among the values of that block only.
+    """
+
+    def __init__(self, values, bins, blocks, step):
+
+        size = values.size
+
+        self.values = values
+        self.step = step
+
+        counts, self.edges = np.histogram(values, bins=bins)
+        self.full = counts.tolist()
+
+        # histogram bin of each value, the last bin includes its right
+        # edge as in np.histogram()
+        self.bin = np.clip(np.searchsorted(self.edges, values,
+                                           side='right') - 1,
+                           0, bins - 1).astype(np.int16)
+        self.bins = bins
+
+        # positions of the values sorted by value, and block of each value
+        self.by_value = np.argsort(values, kind='mergesort').astype(np.int32)
+        self.block_size = max(1, -(-size // blocks))
+        self.blocks = -(-size // self.block_size) if size else 0
+
+        rank = np.empty(size, dtype=np.int32)
+        rank[self.by_value] = np.arange(size, dtype=np.int32)
+        self.block = (rank // self.block_size).astype(np.int16)
+
+        self.bin_counts = self.accumulate(self.bin, self.bins)
+        self.block_counts = self.accumulate(self.block, self.blocks)
+
+        # sums of squares, minimum and maximum of the values after
+        # each position
+        reverse = values[::-1]
+        self.sum_squares = np.append(np.cumsum(np.square(reverse))[::-1], 0)
+        self.minimum = np.minimum.accumulate(reverse)[::-1]
+        self.maximum = np.maximum.accumulate(reverse)[::-1]
+
+    def accumulate(self, groups, n_groups):
+        """Return the number of values of each group after every step-th
+        position, one row per position
+        """
+
+        size = groups.size
+        n_steps = -(-size // self.step)
+
+        step = np.arange(size) // self.step
+        counts = np.bincount(step * n_groups + groups,
+                             minlength=n_steps * n_groups).\
+            reshape(n_steps, n_groups)
+
+        # counts after the last position are zero
+        counts = np.vstack([counts, np.zeros(n_groups, dtype=counts.dtype)])
+
+        return np.cumsum(counts[::-1], axis=0)[::-1]
+
+    def count(self, accumulated, groups, n_groups, start):
+        """Return the number of values of each group after start"""
+
+        step = -(-start // self.step)
+
+        return accumulated[step] + np.bincount(
+            groups[start:step * self.step], minlength=n_groups)
+
+    def kth(self, start, k, block_counts):
+        """Return the k-th smallest value after start"""
+
+        cumulative = np.cumsum(block_counts)
+        block = int(np.searchsorted(cumulative, k, side='right'))
+
+        if block > 0:
+            k -= cumulative[block - 1]
+
+        positions = self.by_value[block * self.block_size:
+                                  (block + 1) * self.block_size]
+
+        return self.values[positions[positions >= start][k]]
+
+    def summarize(self, start):
+        """Return the statistics of the values after start, as returned
+        by summarize()
+        """
+
+        n = int(self.values.size - start)
+
+        selected = self.count(self.bin_counts, self.bin, self.bins, start)
+
+        if n == 0:
+            return {'n': 0, 'median': None, 'rms': None, 'min': None,
+                    'max': None, 'selected': selected.tolist()}
+
+        block_counts = self.count(self.block_counts, self.block,
+                                  self.blocks, start)
+
+        median = self.kth(start, (n - 1) // 2, block_counts)
+        if n % 2 == 0:
+            median = (median + self.kth(start, n // 2, block_counts)) / 2
+
+        return {'n': n,
+                'median': float(median),
+                'rms': float(np.sqrt(self.sum_squares[start] / n)),
+                'min': float(self.minimum[start]),
+                'max': float(self.maximum[start]),
+                'selected': selected.tolist()}
+
+
+class SnrIndex(object):
+    """Statistics of the columns of a matched dataset for any SNR cut.
+
+    Stars are sorted by snr, the stars selected by an SNR cut are the
+    stars after the position of the cut, found by a binary search.
+    Statistics of the selected stars are then computed in time
+    independent of the number of stars, see ColumnIndex.
+
+    Parameters
+    ----------
+    matched_dataset : dict
+        matched dataset as stored in the blob store
+    bins : int
+        number of bins of the histograms
+    blocks : int
+        number of blocks used to find the median
+    steps : int
+        number of positions where histograms are accumulated
+    """
+
+    def __init__(self, matched_dataset, bins=HISTOGRAM_BINS, blocks=1024,
+                 steps=256):
+
+        columns = get_columns(matched_dataset)
+        sizes = set(values.size for values in columns.values())
+
+        self.columns = {}
+
+        if 'snr' not in columns or len(sizes) != 1:
+            return
+
+        size = sizes.pop()
+        order = np.argsort(columns['snr'], kind='mergesort')
+        step = max(1, -(-size // steps))
+
+        self.snr = columns['snr'][order]
+
+        for name, values in columns.items():
+            self.columns[name] = ColumnIndex(values[order], bins, blocks,
+                                             step)
+
+    def get_statistics(self, snr_cut):
+        """Return the statistics of each column for the stars with snr
+        greater than snr_cut, as returned by get_statistics()
+        """
+
+        if not self.columns:
+            return {}
+
+        start = int(np.searchsorted(self.snr, snr_cut, side='right'))
+
+        return {name: dict(column.summarize(start),
+                           size=int(column.values.size),
+                           full=column.full,
+                           edges=column.edges.tolist())
+                for name, column in self.columns.items()}
+
+
+@lru_cache(maxsize=snr_index_cache_size)
+def get_snr_index(blob_id):
+    """Return the SNR index of the matched dataset stored in a blob, blobs
+    are immutable so indexes are kept for the lifetime of the process
+    """
+
+    return SnrIndex(Blob.objects.get(pk=blob_id).load())
@@ -1,5 +1,92 @@
+import gzip
+import json
+import random
+import threading
+import tracemalloc
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+from urllib.parse import urlparse
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import connection
 from django.test import TestCase
-from .models import Job, Metric, Measurement
+from django.test.utils import CaptureQueriesContext
+from django.utils.module_loading import import_string
+from django.utils.text import compress_sequence
+from rest_framework.test import APIClient
+from .cache import get_stats, get_summary
+from .ingestion import ingest, run_worker
+from .models import Job, Metric, Measurement, VersionedPackage, Blob, \
+    JobBlob, ChangedPackage, Ingestion
+from .renderers import stream_json
+from .serializers import decode_json
+from .stats import SnrIndex, get_statistics
+from .views import JobViewSet, compute_summary
+from .viz import events
+from .viz.api_helper import ApiClient, DataCache, data_cache, \
+    response_cache, decode_npz, get_datasets, get_metrics, get_specs, \
+    get_time_series, get_time_series_since, get_url_args
+
+
+def make_job(ci_id, n_packages):
+    """ Make a job payload for the jobs API endpoint """
+
+    measurements = [{'metric': 'AM1', 'value': 3.0, 'metadata': None},
+                    {'metric': 'PA1', 'value': 7.0, 'metadata': None}]
+
+    packages = [{'name': 'package{}'.format(i),
+                 'git_url': 'https://github.com/lsst/package{}.git'
+                            .format(i),
+                 'git_commit': '{:040x}'.format(i),
+                 'git_branch': 'master',
+                 'build_version': 'b2000'}
+                for i in range(n_packages)]
+
+    return {'ci_id': ci_id, 'ci_name': 'validate_drp',
+            'ci_dataset': 'cfht', 'ci_label': 'centos-7',
+            'ci_url': 'https://ci.lsst.codes/job/ci_cfht/{}/'
+                      .format(ci_id),
+            'status': 0, 'measurements': measurements,
+            'packages': packages}
+
+
+def get_data_queries(queries):
+    """ Return the SQL of the captured queries on the dashboard tables,
+        the queries of the database cache are left out
+    """
+
+    return [query['sql'] for query in queries
+            if 'dashboard_' in query['sql']]
+
+
+def make_cache():
+    """ Return a new instance of the default cache, as used by another
+        process
+    """
+
+    params = dict(settings.CACHES['default'])
+    backend = import_string(params.pop('BACKEND'))
+
+    return backend(params.pop('LOCATION', ''), params)
+
+
+def get_json(response):
+    """ Decode a JSON response, streaming responses are consumed """
+
+    if response.streaming:
+        content = b''.join(response.streaming_content)
+    else:
+        content = response.content
+
+    return json.loads(content.decode('utf-8'))
 
 
 class JSONFieldTests(TestCase):
@@ -88,3 +175,1277 @@ class JSONFieldTests(TestCase):
         actual = Measurement.objects.latest('id').metadata
 
         self.assertEqual(actual, expected)
+
+
+class JobIngestionTests(TestCase):
+    """ Test job ingestion through the jobs API endpoint, uses fixtures to
+        load the metric definitions
+    """
+    fixtures = ['test_data']
+
+    def setUp(self):
+        self.user = User.objects.create_user('ingest')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def post_job(self, job):
+
+        with CaptureQueriesContext(connection) as queries:
+            r = self.client.post(reverse('job-list'), job, format='json')
+
+        self.assertEqual(r.status_code, 201)
+
+        return len(get_data_queries(queries))
+
+    def test_nested_objects(self):
+
+        self.post_job(make_job('100', 10))
+        job = Job.objects.latest('id')
+
+        self.assertEqual(job.measurements.count(), 2)
+        self.assertEqual(job.packages.count(), 10)
+
+    def test_queries_independent_of_job_size(self):
+
+        small = self.post_job(make_job('100', 2))
+        large = self.post_job(make_job('101', 200))
+
+        self.assertEqual(small, large)
+
+
+@mock.patch.object(JobViewSet, 'async_ingestion', True)
+class AsyncIngestionTests(TestCase):
+    """ Test jobs queued by the jobs API endpoint and ingested by a worker,
+        uses fixtures to load the metric definitions
+    """
+    fixtures = ['test_data']
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.create_user('ingest'))
+
+    def post_job(self, job, **extra):
+        return self.client.post(reverse('job-list'), job, format='json',
+                                **extra)
+
+    def get_status(self, response):
+
+        r = self.client.get(urlparse(response['Location']).path)
+        self.assertEqual(r.status_code, 200)
+
+        return r.data
+
+    def test_queued(self):
+
+        n_jobs = Job.objects.count()
+
+        r = self.post_job(make_job('100', 10), HTTP_PREFER='respond-async')
+        self.assertEqual(r.status_code, 202)
+        self.assertEqual(r.data['status'], Ingestion.QUEUED)
+        self.assertEqual(Job.objects.count(), n_jobs)
+
+        run_worker(once=True)
+
+        status = self.get_status(r)
+        self.assertEqual(status['status'], Ingestion.DONE)
+
+        job = Job.objects.latest('id')
+        self.assertEqual(job.packages.count(), 10)
+        self.assertEqual(urlparse(status['links']['job']).path,
+                         reverse('job-detail', kwargs={'pk': job.pk}))
+
+        # the payload is dropped once the job is written
+        self.assertIsNone(Ingestion.objects.get().payload)
+
+    def test_sync(self):
+
+        # jobs are ingested by the request unless asked otherwise
+        r = self.post_job(make_job('100', 1))
+        self.assertEqual(r.status_code, 201)
+        self.assertFalse(Ingestion.objects.exists())
+
+    def test_invalid(self):
+
+        job = make_job('100', 1)
+        del job['measurements']
+
+        r = self.post_job(job, HTTP_PREFER='respond-async')
+        self.assertEqual(r.status_code, 202)
+
+        run_worker(once=True)
+
+        status = self.get_status(r)
+        self.assertEqual(status['status'], Ingestion.FAILED)
+
+        # the errors are returned as JSON, not as their string
+        # representation
+        self.assertIsInstance(status['errors'], dict)
+        self.assertIn('measurements', status['errors'])
+
+    def test_cached(self):
+
+        url = reverse('job-list')
+        count = self.client.get(url, {'ci_dataset': 'cfht'}).data['count']
+
+        r = self.post_job(make_job('100', 1), HTTP_PREFER='respond-async')
+        self.assertEqual(r.status_code, 202)
+
+        # the worker runs in another process, with its own cache instance
+        with mock.patch('dashboard.cache.cache', make_cache()):
+            run_worker(once=True)
+
+        r = self.client.get(url, {'ci_dataset': 'cfht'})
+        self.assertEqual(r.data['count'], count + 1)
+
+    def test_reclaimed(self):
+
+        r = self.post_job(make_job('100', 1), HTTP_PREFER='respond-async')
+        ingestion = Ingestion.objects.get()
+
+        run_worker(once=True)
+        n_jobs = Job.objects.count()
+
+        # a worker that claimed the ingestion again does not write the
+        # job twice
+        ingest(ingestion)
+
+        self.assertEqual(Job.objects.count(), n_jobs)
+        self.assertEqual(self.get_status(r)['status'], Ingestion.DONE)
+
+    def test_claim(self):
+
+        running = Ingestion.objects.create(status=Ingestion.RUNNING)
+        queued = Ingestion.objects.create()
+
+        self.assertEqual(Ingestion.objects.claim(timeout=3600), queued)
+        self.assertIsNone(Ingestion.objects.claim(timeout=3600))
+
+        # ingestions of a stopped worker are claimed again
+        Ingestion.objects.filter(pk=running.pk).update(
+            updated=running.updated - timedelta(hours=2))
+        self.assertEqual(Ingestion.objects.claim(timeout=3600), running)
+
+    def test_attempts(self):
+
+        ingestion = Ingestion.objects.create()
+
+        for attempt in range(2):
+            self.assertEqual(Ingestion.objects.claim(timeout=3600,
+                                                     max_attempts=2),
+                             ingestion)
+            Ingestion.objects.filter(pk=ingestion.pk).update(
+                updated=ingestion.updated - timedelta(hours=2))
+
+        # a worker stopped by the ingestion every time, it is not
+        # claimed again
+        self.assertIsNone(Ingestion.objects.claim(timeout=3600,
+                                                  max_attempts=2))
+
+        ingestion = Ingestion.objects.get(pk=ingestion.pk)
+        self.assertEqual(ingestion.status, Ingestion.FAILED)
+        self.assertEqual(ingestion.attempts, 2)
+        self.assertIn('detail', ingestion.errors)
+
+
+class ChangedPackagesTests(TestCase):
+    """ Test the packages that changed with respect to the previous job,
+        uses fixtures to load initial data
+    """
+    fixtures = ['test_data']
+
+    def setUp(self):
+        call_command('backfill_changed_packages', stdout=StringIO())
+
+    def get_changed(self, ci_id, ci_dataset='cfht'):
+        job = Job.objects.get(ci_id=ci_id, ci_dataset=ci_dataset)
+        return [pkg.name for pkg in job.changed_packages.all()]
+
+    def test_backfill(self):
+
+        # first job of the lineage
+        self.assertEqual(self.get_changed('1'), [])
+        self.assertEqual(self.get_changed('2'), ['afw'])
+        self.assertEqual(self.get_changed('3'), [])
+        self.assertEqual(self.get_changed('7'), ['cfitsio'])
+        self.assertEqual(self.get_changed('7', 'decam'), ['cfitsio'])
+
+    def test_ingestion(self):
+
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create_user('ingest'))
+
+        job = make_job('8', 1)
+        r = client.post(reverse('job-list'), job, format='json')
+        self.assertEqual(r.status_code, 201)
+
+        self.assertEqual(self.get_changed('8'), ['package0'])
+
+    def test_measurements_endpoint(self):
+
+        r = APIClient().get(reverse('measurements-list'),
+                            {'job__ci_dataset': 'cfht', 'metric': 'AM1'})
+
+        changed = [m['changed_packages'] for m in r.data['results']]
+        self.assertEqual([len(c) for c in changed], [0, 1, 0, 1, 0, 1])
+
+
+class MetricUpsertTests(TestCase):
+    """ Test the bulk upsert of metric definitions, uses fixtures to load
+        initial data
+    """
+    fixtures = ['test_data']
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.create_user('ingest'))
+        cache.clear()
+
+    def get_definitions(self):
+
+        r = self.client.get(reverse('metric-list'))
+        definitions = [{key: metric[key]
+                        for key in ('metric', 'unit', 'description',
+                                    'operator', 'parameters', 'specs',
+                                    'reference')}
+                       for metric in r.data['results']]
+
+        # the JSON fields are returned as text
+        for definition in definitions:
+            for key in ('parameters', 'specs', 'reference'):
+                definition[key] = decode_json(definition[key])
+
+        return definitions + [{'metric': 'AF1', 'description': 'AF1',
+                               'specs': [{'name': 'design', 'value': 10.0}]}]
+
+    def upsert(self, definitions):
+        return self.client.post(reverse('metric-upsert'), definitions,
+                                format='json')
+
+    def test_idempotent(self):
+
+        definitions = self.get_definitions()
+        n_metrics = Metric.objects.count()
+
+        r = self.upsert(definitions)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.data, {'created': 1, 'updated': 0,
+                                  'unchanged': n_metrics})
+
+        r = self.upsert(definitions)
+        self.assertEqual(r.data, {'created': 0, 'updated': 0,
+                                  'unchanged': n_metrics + 1})
+
+        self.assertEqual(Metric.objects.get(pk='AF1').operator, '<')
+
+    def test_updated(self):
+
+        url = reverse('metric-detail', kwargs={'pk': 'AM1'})
+        self.client.get(url)
+
+        definitions = self.get_definitions()
+        self.upsert(definitions)
+
+        for definition in definitions:
+            if definition['metric'] == 'AM1':
+                definition['specs'][0]['value'] += 1
+                spec = definition['specs'][0]
+
+        r = self.upsert(definitions)
+        self.assertEqual(r.data['updated'], 1)
+
+        # the cached response of the metric is invalidated
+        specs = decode_json(self.client.get(url).data['specs'])
+        self.assertEqual(specs[0], spec)
+
+    def test_invalid(self):
+
+        definitions = self.get_definitions()
+        definitions[-1]['specs'] = [{'name': 'design'}]
+
+        # nothing is written if a definition is invalid
+        with self.assertNumQueries(0):
+            r = self.upsert(definitions)
+
+        self.assertEqual(r.status_code, 400)
+        self.assertFalse(Metric.objects.filter(pk='AF1').exists())
+
+        r = self.upsert([{'metric': 'AF1', 'description': 'AF1'}] * 2)
+        self.assertEqual(r.status_code, 400)
+
+
+class CacheInvalidationTests(TestCase):
+    """ Test that cached API responses are invalidated when data is
+        written, uses fixtures to load initial data
+    """
+    fixtures = ['test_data']
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.create_user('ingest'))
+
+    def get_count(self):
+        r = self.client.get(reverse('measurements-list'),
+                            {'job__ci_dataset': 'cfht', 'metric': 'AM1'})
+        return r.data['count']
+
+    def test_new_job(self):
+
+        count = self.get_count()
+
+        r = self.client.post(reverse('job-list'), make_job('8', 1),
+                             format='json')
+        self.assertEqual(r.status_code, 201)
+
+        self.assertEqual(self.get_count(), count + 1)
+
+    def test_metric(self):
+
+        url = reverse('metric-detail', kwargs={'pk': 'AM1'})
+        self.client.get(url)
+
+        metric = Metric.objects.get(pk='AM1')
+        metric.unit = 'arcsec'
+        metric.save()
+
+        self.assertEqual(self.client.get(url).data['unit'], 'arcsec')
+
+    def test_shared(self):
+
+        # the cache is not local to the process
+        self.assertNotIsInstance(caches['default'], LocMemCache)
+
+        count = self.get_count()
+
+        # a job written by another process, with its own cache instance
+        with mock.patch('dashboard.cache.cache', make_cache()):
+            r = self.client.post(reverse('job-list'), make_job('8', 1),
+                                 format='json')
+            self.assertEqual(r.status_code, 201)
+
+        self.assertEqual(self.get_count(), count + 1)
+
+    def test_stats(self):
+
+        self.get_count()
+        stats = get_stats()
+
+        self.get_count()
+        self.client.post(reverse('job-list'), make_job('8', 1),
+                         format='json')
+        self.get_count()
+
+        r = self.client.get(reverse('cache-list'))
+
+        self.assertEqual(r.data['hits'], stats['hits'] + 1)
+        self.assertEqual(r.data['misses'], stats['misses'] + 1)
+        self.assertGreater(r.data['invalidations'], stats['invalidations'])
+
+    @mock.patch('dashboard.cache.STATS_INTERVAL', 3600)
+    def test_stats_batched(self):
+
+        self.get_count()
+        get_stats()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.get_count()
+
+        # a cache hit is counted by the process, not written to the cache
+        writes = [query['sql'] for query in queries
+                  if not query['sql'].lstrip().upper().startswith('SELECT')]
+        self.assertEqual(writes, [])
+
+
+class ConditionalGetTests(TestCase):
+    """ Test conditional requests to the API endpoints, uses fixtures to
+        load initial data
+    """
+    fixtures = ['test_data']
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.create_user('ingest'))
+
+    def test_etag(self):
+
+        url = reverse('measurements-list')
+        params = {'job__ci_dataset': 'cfht', 'metric': 'AM1'}
+
+        etag = self.client.get(url, params)['ETag']
+
+        r = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 304)
+
+        # a job of another dataset does not modify the response
+        job = make_job('8', 1)
+        job['ci_dataset'] = 'decam'
+        self.client.post(reverse('job-list'), job, format='json')
+
+        r = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 304)
+
+        self.client.post(reverse('job-list'), make_job('8', 1),
+                         format='json')
+
+        r = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 200)
+        self.assertNotEqual(r['ETag'], etag)
+
+    def test_last_modified(self):
+
+        for name in ('job-list', 'metric-list', 'datasets-list',
+                     'defaults-list', 'apps-list'):
+            url = reverse(name)
+            last_modified = self.client.get(url)['Last-Modified']
+
+            r = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(r.status_code, 304)
+
+
+class SparseFieldsTests(TestCase):
+    """ Test the fields and exclude query parameters of the jobs endpoint,
+        uses fixtures to load initial data
+    """
+    fixtures = ['test_data']
+
+    def setUp(self):
+        self.client = APIClient()
+
+        # responses cached by other tests are not reused
+        cache.clear()
+
+    def get_jobs(self, **params):
+
+        with CaptureQueriesContext(connection) as queries:
+            r = self.client.get(reverse('job-list'), params)
+
+        self.assertEqual(r.status_code, 200)
+
+        return r.data['results'], get_data_queries(queries)
+
+    def test_fields(self):
+
+        jobs, queries = self.get_jobs(fields='ci_id,date,status')
+
+        for job in jobs:
+            self.assertEqual(set(job), {'ci_id', 'date', 'status'})
+
+        # nested relations and columns not requested are not read
+        for sql in queries:
+            self.assertNotIn('dashboard_measurement', sql)
+            self.assertNotIn('dashboard_versionedpackage', sql)
+            self.assertNotIn('ci_url', sql)
+
+    def test_exclude(self):
+
+        jobs, queries = self.get_jobs(exclude='measurements,packages')
+
+        for job in jobs:
+            self.assertEqual(set(job), {'ci_id', 'ci_name', 'ci_dataset',
+                                        'ci_label', 'date', 'ci_url',
+                                        'status', 'links'})
+
+        for sql in queries:
+            self.assertNotIn('dashboard_measurement', sql)
+
+    def test_unknown_field(self):
+
+        r = self.client.get(reverse('job-list'), {'fields': 'ci_id,foo'})
+        self.assertEqual(r.status_code, 400)
+
+
+class KeysetPaginationTests(TestCase):
+    """ Test the pagination of the jobs endpoint with cursors, uses
+        fixtures to load initial data
+    """
+    fixtures = ['test_data']
+
+    def setUp(self):
+        self.client = APIClient()
+        cache.clear()
+
+        Job.objects.bulk_create(
+            [Job(ci_id='k{}'.format(i), ci_name='validate_drp',
+                 ci_dataset='keyset', ci_label='centos-7',
+                 ci_url='https://ci.lsst.codes/job/ci_keyset/{}/'.format(i))
+             for i in range(25)])
+
+        # jobs three by three have the same date
+        jobs = Job.objects.filter(ci_dataset='keyset').order_by('pk')
+        date = jobs[0].date
+        for i, job in enumerate(jobs):
+            Job.objects.filter(pk=job.pk).update(
+                date=date - timedelta(hours=i // 3))
+
+        self.expected = list(jobs.order_by('date', 'pk').
+                             values_list('ci_id', flat=True))
+
+        # pages of 10 jobs
+        patcher = mock.patch.object(JobViewSet, 'paginate_by', 10)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_page(self, url, params=None):
+
+        with CaptureQueriesContext(connection) as queries:
+            r = self.client.get(url, params or {})
+
+        self.assertEqual(r.status_code, 200)
+
+        return r.data, get_data_queries(queries)
+
+    def test_next_and_previous(self):
+
+        data, _ = self.get_page(reverse('job-list'), {'ci_dataset': 'keyset'})
+
+        pages = []
+        while True:
+            self.assertEqual(data['count'], 25)
+            pages.append([job['ci_id'] for job in data['results']])
+            if data['next'] is None:
+                break
+            data, queries = self.get_page(data['next'])
+
+            # rows before the page are not read
+            for sql in queries:
+                self.assertNotIn('OFFSET', sql.upper())
+
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual(sum(pages, []), self.expected)
+
+        # walk back to the first page
+        while data['previous'] is not None:
+            data, _ = self.get_page(data['previous'])
+            self.assertEqual([job['ci_id'] for job in data['results']],
+                             pages[-2])
+            pages.pop()
+
+        self.assertEqual(len(pages), 1)
+
+    def test_count_opt_out(self):
+
+        data, queries = self.get_page(reverse('job-list'),
+                                      {'ci_dataset': 'keyset',
+                                       'count': 'false'})
+
+        self.assertNotIn('count', data)
+        for sql in queries:
+            self.assertNotIn('COUNT(', sql.upper())
+
+        data, _ = self.get_page(data['next'])
+        self.assertNotIn('count', data)
+
+    def test_page_numbers(self):
+
+        data, _ = self.get_page(reverse('job-list'), {'ci_dataset': 'keyset',
+                                                      'page': 2})
+
+        self.assertEqual(data['count'], 25)
+        self.assertEqual([job['ci_id'] for job in data['results']],
+                         self.expected[10:20])
+
+
+class HomeSummaryTests(TestCase):
+    """ Test the summary shown by the home page, uses fixtures to load
+        initial data
+    """
+    fixtures = ['test_data']
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.create_user('home'))
+        cache.clear()
+
+    def get_summary(self):
+
+        r = self.client.get(reverse('home'))
+        self.assertEqual(r.status_code, 200)
+
+        return {key: r.context[key] for key in ('n_metrics', 'n_packages',
+                                                'n_jobs', 'n_meas',
+                                                'datasets', 'last')}
+
+    def get_expected(self):
+
+        summary = compute_summary()
+        return {'n_metrics': summary['n_metrics'],
+                'n_packages': summary['last']['n_packages'],
+                'n_jobs': summary['n_jobs'],
+                'n_meas': summary['n_meas'],
+                'datasets': ', '.join(summary['datasets']),
+                'last': summary['last']['date']}
+
+    def test_cached(self):
+
+        self.assertEqual(self.get_summary(), self.get_expected())
+
+        # the summary is served from the cache
+        with CaptureQueriesContext(connection) as queries:
+            self.get_summary()
+
+        self.assertEqual(get_data_queries(queries), [])
+
+    def test_ingestion(self):
+
+        self.get_summary()
+
+        job = make_job('8', 3)
+        job['ci_dataset'] = 'decam'
+        self.client.post(reverse('job-list'), job, format='json')
+
+        self.client.post(reverse('metric-list'),
+                         {'metric': 'AF1', 'description': 'AF1'},
+                         format='json')
+
+        # the summary is computed again once
+        summary = self.get_summary()
+
+        self.assertEqual(summary, self.get_expected())
+        self.assertIn('decam', summary['datasets'])
+        self.assertEqual(summary['n_packages'], 3)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.get_summary()
+
+        self.assertEqual(get_data_queries(queries), [])
+
+    def test_deletion(self):
+
+        self.get_summary()
+
+        Job.objects.latest('pk').delete()
+
+        self.assertEqual(self.get_summary(), self.get_expected())
+
+    def test_concurrent_write(self):
+
+        def compute():
+            summary = compute_summary()
+            # a job deleted while the summary is computed
+            Job.objects.latest('pk').delete()
+            return summary
+
+        get_summary(compute)
+
+        # the summary missing the write is not served
+        self.assertEqual(self.get_summary(), self.get_expected())
+
+
+class JobEventsTests(TestCase):
+    """ Test the notification of ingested jobs to the bokeh sessions, uses
+        fixtures to load the metric definitions
+    """
+    fixtures = ['test_data']
+
+    class Session(object):
+
+        def __init__(self):
+            self.received = threading.Event()
+            self.events = []
+
+        def on_job_event(self, event):
+            self.events.append(event)
+            self.received.set()
+
+    def setUp(self):
+        self.broker = events.Broker()
+        self.listener = events.Listener(self.broker, 'localhost:0')
+        self.listener.start()
+
+    def tearDown(self):
+        self.listener.stop()
+
+    def test_ingestion(self):
+
+        cfht = self.Session()
+        self.broker.subscribe(cfht.on_job_event, 'cfht', 'AM1')
+
+        decam = self.Session()
+        self.broker.subscribe(decam.on_job_event, 'decam', 'AM1')
+
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create_user('ingest'))
+
+        with mock.patch('dashboard.events.SQUASH_EVENTS_ADDRESS',
+                        self.listener.address):
+            client.post(reverse('job-list'), make_job('8', 1),
+                        format='json')
+
+        job = Job.objects.latest('pk')
+
+        self.assertTrue(cfht.received.wait(5))
+        self.assertEqual(cfht.events, [{'ci_dataset': 'cfht',
+                                        'metrics': ['AM1', 'PA1'],
+                                        'job_id': job.pk}])
+        self.assertEqual(decam.events, [])
+
+    def test_subscription_change(self):
+
+        session = self.Session()
+        subscription = self.broker.subscribe(session.on_job_event,
+                                             'cfht', 'AM1')
+        subscription.metric = 'PF1'
+
+        self.broker.dispatch({'ci_dataset': 'cfht', 'metrics': ['AM1'],
+                              'job_id': 1})
+        self.assertEqual(session.events, [])
+
+        # sessions destroyed are unsubscribed
+        del session
+        self.broker.dispatch({'ci_dataset': 'cfht', 'metrics': ['PF1'],
+                              'job_id': 1})
+        self.assertEqual(self.broker.subscriptions, [])
+
+
+class TimeSeriesTests(TestCase):
+    """ Test the column-oriented time series consumed by the monitor app,
+        uses fixtures to load initial data
+    """
+    fixtures = ['test_data']
+
+    def setUp(self):
+        call_command('backfill_changed_packages', stdout=StringIO())
+
+    def get_time_series(self, **params):
+        r = APIClient().get(reverse('timeseries-list'), params)
+        self.assertEqual(r.status_code, 200)
+        return get_json(r)
+
+    def test_columns(self):
+
+        data = self.get_time_series(ci_dataset='cfht', metric='AM1',
+                                    window='all')
+
+        self.assertEqual(data['ci_ids'], ['1', '2', '3', '5', '6', '7'])
+        self.assertEqual(data['values'], [4.0, 3.0, 3.0, 3.5, 3.5, 3.0])
+        self.assertEqual(data['names'], [[], ['afw'], [], ['afw'], [],
+                                         ['cfitsio']])
+
+        # 2016-09-15T00:00:00.001Z
+        self.assertEqual(data['dates'][0], 1473897600001.0)
+
+        for column in data.values():
+            self.assertEqual(len(column), 6)
+
+    def test_git_urls(self):
+
+        ChangedPackage.objects.filter(name='cfitsio').update(
+            git_url='https://github.com/lsst/obs_cfht.git')
+
+        data = self.get_time_series(ci_dataset='cfht', metric='AM1',
+                                    window='all')
+
+        # only the .git suffix is removed from the repository URL
+        self.assertTrue(data['git_urls'][5][0].startswith(
+            'https://github.com/lsst/obs_cfht/commit/'))
+
+    def test_window(self):
+
+        # move the first job out of the one week window
+        job = Job.objects.get(ci_id='1', ci_dataset='cfht')
+        Job.objects.filter(pk=job.pk).update(
+            date=job.date - timedelta(weeks=2))
+
+        data = self.get_time_series(ci_dataset='cfht', metric='AM1',
+                                    window='weeks')
+
+        self.assertEqual(data['ci_ids'], ['2', '3', '5', '6', '7'])
+
+    def test_npz_format(self):
+
+        params = {'ci_dataset': 'cfht', 'metric': 'AM1', 'window': 'all'}
+
+        r = APIClient().get(reverse('timeseries-list'), params,
+                            HTTP_ACCEPT='application/x-npz')
+        self.assertEqual(r['Content-Type'], 'application/x-npz')
+
+        data = decode_npz(r.content)
+        expected = self.get_time_series(**params)
+
+        # numbers are sent as arrays, other columns as in JSON
+        self.assertIsInstance(data['values'], np.ndarray)
+        self.assertEqual(data['values'].tolist(), expected['values'])
+        self.assertEqual(data['dates'].tolist(), expected['dates'])
+        self.assertEqual(data['ci_ids'], expected['ci_ids'])
+        self.assertEqual(data['names'], expected['names'])
+
+
+class StreamingResponseTests(TestCase):
+    """ Test that large responses are streamed and compressed, uses
+        fixtures to load initial data
+    """
+    fixtures = ['test_data']
+
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('timeseries-list')
+        self.params = {'ci_dataset': 'cfht', 'metric': 'AM1',
+                       'window': 'all'}
+
+    def test_gzip(self):
+
+        r = self.client.get(self.url, self.params,
+                            HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertTrue(r.streaming)
+        self.assertEqual(r['Content-Encoding'], 'gzip')
+
+        content = gzip.decompress(b''.join(r.streaming_content))
+        self.assertEqual(json.loads(content.decode('utf-8')),
+                         get_json(self.client.get(self.url, self.params)))
+
+        # the ETag of compressed responses is revalidated
+        r = self.client.get(self.url, self.params,
+                            HTTP_ACCEPT_ENCODING='gzip',
+                            HTTP_IF_NONE_MATCH=r['ETag'])
+        self.assertEqual(r.status_code, 304)
+
+    def test_gzip_api_only(self):
+
+        # pages holding a CSRF token are not compressed
+        r = self.client.get(reverse('admin:login'),
+                            HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(r.status_code, 200)
+        self.assertFalse(r.has_header('Content-Encoding'))
+
+        r = self.client.get(self.url, dict(self.params, format='api'),
+                            HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(r.has_header('Content-Encoding'))
+
+    def get_peak_memory(self, size):
+        """ Memory high-water mark in bytes while a response with size
+            matched stars is generated and compressed, and its size
+        """
+
+        data = {'metadata': {},
+                'matchedDataset': {
+                    column: {'value': [random.random()
+                                       for i in range(size)],
+                             'label': column, 'unit': ''}
+                    for column in ('snr', 'mag', 'dist')}}
+
+        tracemalloc.start()
+        try:
+            length = 0
+            for chunk in compress_sequence(stream_json(data)):
+                length += len(chunk)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        return peak, length
+
+    def test_flat_memory(self):
+
+        small, _ = self.get_peak_memory(10000)
+        large, length = self.get_peak_memory(200000)
+
+        # twenty times more data does not take more memory
+        self.assertLess(large, 2 * small)
+        self.assertLess(large, length)
+
+
+class MeasurementFilterTests(TestCase):
+    """ Test filtering measurements by job date, uses fixtures to load
+        initial data
+    """
+    fixtures = ['test_data']
+
+    def get_ci_ids(self, **params):
+        params.update({'job__ci_dataset': 'cfht', 'metric': 'AM1'})
+        r = APIClient().get(reverse('measurements-list'), params)
+        self.assertEqual(r.status_code, 200)
+        return [m['ci_id'] for m in r.data['results']]
+
+    def test_since_until(self):
+
+        self.assertEqual(self.get_ci_ids(since='2016-09-16T00:00:00Z'),
+                         ['5', '6', '7'])
+        self.assertEqual(self.get_ci_ids(until='2016-09-16T00:00:00Z'),
+                         ['1', '2', '3'])
+        self.assertEqual(self.get_ci_ids(since='2016-09-15T08:00:00Z',
+                                         until='2016-09-16T08:00:00.001Z'),
+                         ['2', '3', '5'])
+
+    def test_window(self):
+
+        # move the first job out of the one week window
+        job = Job.objects.get(ci_id='1', ci_dataset='cfht')
+        Job.objects.filter(pk=job.pk).update(
+            date=job.date - timedelta(weeks=2))
+
+        self.assertEqual(self.get_ci_ids(window='weeks'),
+                         ['2', '3', '5', '6', '7'])
+        self.assertEqual(self.get_ci_ids(window='months'),
+                         ['1', '2', '3', '5', '6', '7'])
+
+
+def seed_database(n_jobs, n_packages, datasets=('cfht', 'decam')):
+    """ Seed the database with n_jobs jobs per dataset, each one with
+        n_packages packages and a measurement for each metric
+    """
+
+    metrics = list(Metric.objects.all())
+
+    jobs = [Job(ci_id=str(i), ci_name='validate_drp', ci_dataset=dataset,
+                ci_label='centos-7',
+                ci_url='https://ci.lsst.codes/job/ci_{}/{}/'.format(dataset,
+                                                                    i))
+            for i in range(n_jobs) for dataset in datasets]
+    Job.objects.bulk_create(jobs)
+
+    # jobs are registered with the current date, spread them
+    # 8 hours apart
+    with connection.cursor() as cursor:
+        cursor.execute('UPDATE {} SET date = DATE_SUB(date, INTERVAL '
+                       '8 * (%s - id) HOUR)'.format(Job._meta.db_table),
+                       [Job.objects.latest('id').id])
+
+    job_ids = Job.objects.values_list('id', flat=True)
+
+    Measurement.objects.bulk_create(
+        [Measurement(job_id=job_id, metric=metric, value=1.0)
+         for job_id in job_ids for metric in metrics])
+
+    VersionedPackage.objects.bulk_create(
+        [VersionedPackage(job_id=job_id, name='package{}'.format(i),
+                          git_url='https://github.com/lsst/package{}.git'
+                                  .format(i),
+                          git_commit='{:040x}'.format(i),
+                          git_branch='master', build_version='b2000')
+         for job_id in job_ids for i in range(n_packages)])
+
+
+@skipUnless(connection.vendor == 'mysql',
+            'query plans are checked with MySQL EXPLAIN')
+class QueryPlanTests(TestCase):
+    """ Test that the queries issued by the API endpoints and the home page
+        use indexes instead of full table scans, on a seeded database of
+        realistic size
+    """
+    fixtures = ['test_data']
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_database(n_jobs=1000, n_packages=80)
+
+    def assert_no_full_scan(self, url, params=None):
+
+        with CaptureQueriesContext(connection) as queries:
+            r = APIClient().get(url, params)
+
+        self.assertEqual(r.status_code, 200)
+
+        with connection.cursor() as cursor:
+            for sql in get_data_queries(queries):
+                if not sql.startswith('SELECT'):
+                    continue
+
+                cursor.execute('EXPLAIN ' + sql)
+                columns = [c[0] for c in cursor.description]
+
+                for row in cursor.fetchall():
+                    plan = dict(zip(columns, row))
+                    self.assertNotEqual(plan['type'], 'ALL',
+                                        'Full scan on {}: {}'.format(
+                                            plan['table'], sql))
+
+    def test_measurements(self):
+        self.assert_no_full_scan(reverse('measurements-list'),
+                                 {'job__ci_dataset': 'cfht',
+                                  'metric': 'AM1', 'window': 'weeks'})
+
+    def test_jobs(self):
+        self.assert_no_full_scan(reverse('job-list'))
+        self.assert_no_full_scan(reverse('job-list'), {'ci_dataset': 'cfht'})
+
+    def test_apps(self):
+        self.assert_no_full_scan(reverse('apps-list'),
+                                 {'ci_id': '500', 'ci_dataset': 'cfht',
+                                  'metric': 'AM1'})
+
+    def test_home(self):
+        self.assert_no_full_scan(reverse('home'))
+
+
+class BlobStoreTests(TestCase):
+    """ Test that job blobs are deduplicated in the blob store and loaded
+        by the apps endpoint, uses fixtures to load initial data
+    """
+    fixtures = ['test_data']
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.create_user('blob'))
+
+        self.matched_dataset = {'snr': {'value': [10.0, 200.0],
+                                        'label': 'SNR', 'unit': ''},
+                                'dist': {'value': [4.0, 3.0],
+                                         'label': 'dist',
+                                         'unit': 'marcsec'}}
+
+    def post_job(self, ci_id, identifier):
+
+        job = make_job(ci_id, 1)
+
+        # older clients send the string representation of Python objects
+        job['measurements'][0]['metadata'] = str(
+            {'blobs': {'matchedDataset': identifier}})
+
+        job['blobs'] = str([{'identifier': identifier,
+                             'name': 'matchedDataset',
+                             'data': self.matched_dataset}])
+
+        r = self.client.post(reverse('job-list'), job, format='json')
+        self.assertEqual(r.status_code, 201)
+        self.assertNotIn('blobs', r.data)
+
+    def test_deduplication(self):
+
+        self.post_job('100', 'a' * 32)
+        self.post_job('101', 'b' * 32)
+
+        self.assertEqual(Blob.objects.count(), 1)
+        self.assertEqual(JobBlob.objects.count(), 2)
+
+    def test_apps_endpoint(self):
+
+        self.post_job('100', 'a' * 32)
+
+        r = self.client.get(reverse('apps-list'), {'ci_id': '100',
+                                                   'ci_dataset': 'cfht',
+                                                   'metric': 'AM1'})
+
+        data = get_json(r)
+        self.assertEqual(data['matchedDataset'], self.matched_dataset)
+        self.assertEqual(data['metadata'], {})
+
+    def test_apps_npz_format(self):
+
+        self.post_job('100', 'a' * 32)
+
+        r = self.client.get(reverse('apps-list'), {'ci_id': '100',
+                                                   'ci_dataset': 'cfht',
+                                                   'metric': 'AM1',
+                                                   'format': 'npz'})
+        self.assertEqual(r['Content-Type'], 'application/x-npz')
+
+        snr = decode_npz(r.content)['matchedDataset']['snr']
+        self.assertEqual(snr['value'].dtype, np.float64)
+        self.assertEqual(snr['value'].tolist(), [10.0, 200.0])
+        self.assertEqual(snr['label'], 'SNR')
+
+    def test_max_points(self):
+
+        self.post_job('100', 'a' * 32)
+
+        r = self.client.get(reverse('apps-list'), {'ci_id': '100',
+                                                   'ci_dataset': 'cfht',
+                                                   'metric': 'AM1',
+                                                   'snr_cut': 100,
+                                                   'max_points': 1})
+
+        # statistics are computed on the full dataset
+        data = get_json(r)
+        self.assertEqual(len(data['matchedDataset']['snr']['value']), 1)
+        self.assertEqual(data['statistics']['dist']['size'], 2)
+        self.assertEqual(data['statistics']['dist']['n'], 1)
+        self.assertEqual(data['statistics']['dist']['median'], 3.0)
+
+    def test_statistics(self):
+
+        self.post_job('100', 'a' * 32)
+
+        r = self.client.get(reverse('apps-statistics'), {'ci_id': '100',
+                                                         'ci_dataset': 'cfht',
+                                                         'metric': 'AM1',
+                                                         'snr_cut': 5})
+
+        dist = r.data['dist']
+        self.assertEqual(dist['n'], 2)
+        self.assertEqual(dist['median'], 3.5)
+        self.assertAlmostEqual(dist['rms'], 12.5 ** 0.5)
+        self.assertEqual(sum(dist['full']), 2)
+        self.assertEqual(dist['selected'], dist['full'])
+
+    def test_snr_index(self):
+
+        random = np.random.RandomState(0)
+        matched_dataset = {
+            'snr': {'value': np.round(random.rand(1001) * 50).tolist()},
+            'dist': {'value': random.rand(1001).tolist()}}
+
+        index = SnrIndex(matched_dataset, blocks=16, steps=8)
+
+        for snr_cut in (-1, 0, 10.5, 25, 49, 50):
+            statistics = get_statistics(matched_dataset, snr_cut)
+            self.assertEqual(index.get_statistics(snr_cut).keys(),
+                             statistics.keys())
+
+            for name, expected in statistics.items():
+                actual = index.get_statistics(snr_cut)[name]
+                for key in ('n', 'median', 'min', 'max', 'selected',
+                            'full'):
+                    self.assertEqual(actual[key], expected[key])
+                if expected['rms'] is not None:
+                    self.assertAlmostEqual(actual['rms'], expected['rms'])
+
+    def test_metadata_json(self):
+
+        self.post_job('100', 'a' * 32)
+
+        metadata = Measurement.objects.filter(job__ci_id='100', metric='AM1').\
+            values_list('metadata', flat=True)[0]
+
+        # metadata sent as Python literals is stored as JSON
+        self.assertEqual(json.loads(metadata),
+                         {'blobs': {'matchedDataset': 'a' * 32}})
+
+
+class TestClientSession(object):
+    """ Stand-in for a requests session that sends the requests to the
+        Django test client and records them
+    """
+
+    class Response(object):
+
+        def __init__(self, response):
+            self.response = response
+            self.status_code = response.status_code
+            self.headers = dict(response.items())
+
+            if response.streaming:
+                self.content = b''.join(response.streaming_content)
+            else:
+                self.content = response.content
+
+        def raise_for_status(self):
+            if self.response.status_code >= 400:
+                raise RuntimeError(self.response.status_code)
+
+        def json(self):
+            return json.loads(self.content.decode('utf-8'))
+
+    def __init__(self):
+        self.client = APIClient()
+        self.urls = []
+        self.status_codes = []
+
+    def get(self, url, params=None, headers=None):
+        self.urls.append(url)
+
+        # e.g. If-None-Match is sent as HTTP_IF_NONE_MATCH
+        meta = {'HTTP_' + name.upper().replace('-', '_'): value
+                for name, value in (headers or {}).items()}
+
+        r = self.Response(self.client.get(urlparse(url).path, params,
+                                          **meta))
+        self.status_codes.append(r.status_code)
+
+        return r
+
+
+class ApiClientTests(TestCase):
+    """ Test the number of requests made by the bokeh apps, uses fixtures
+        to load initial data
+    """
+    fixtures = ['test_data']
+
+    def setUp(self):
+        self.session = TestClientSession()
+
+        self.api_url = 'http://testserver{}'.format(reverse('api-root'))
+        self.api = ApiClient(api_url=self.api_url, session=self.session)
+
+        data_cache.clear()
+        response_cache.clear()
+
+    def test_monitor_startup(self):
+
+        # requests made when a session of the monitor app starts
+        metrics = get_metrics(default='AM1', client=self.api)
+        get_datasets(default='cfht', client=self.api)
+
+        doc = SimpleNamespace(session_context=SimpleNamespace(request=None))
+        args = get_url_args(doc=lambda: doc,
+                            defaults={'metric': metrics['default']},
+                            client=self.api)
+
+        get_specs(args['metric'], client=self.api)
+        get_time_series(args['ci_dataset'], args['metric'], args['window'],
+                        client=self.api)
+
+        # api root, metrics, datasets, defaults and timeseries
+        self.assertEqual(len(self.session.urls), 5)
+
+    def test_shared_data_cache(self):
+
+        data = get_time_series('cfht', 'AM1', 'months', client=self.api)
+        n_requests = len(self.session.urls)
+
+        # a new session gets the data without requesting it
+        api = ApiClient(api_url=self.api_url, session=self.session)
+        self.assertEqual(get_time_series('cfht', 'AM1', 'months', client=api),
+                         data)
+        self.assertEqual(len(self.session.urls), n_requests)
+
+    def test_binary_format(self):
+
+        data = get_time_series('cfht', 'AM1', 'all', client=self.api)
+        data_cache.clear()
+
+        # the binary columnar format decodes to the same columns
+        api = ApiClient(api_url=self.api_url, session=self.session,
+                        binary=False)
+        self.assertEqual(get_time_series('cfht', 'AM1', 'all', client=api),
+                         data)
+
+        self.assertTrue(self.api.binary)
+        self.assertIsInstance(data['values'], list)
+
+    def test_time_series_since(self):
+
+        data = get_time_series('cfht', 'AM1', 'all', client=self.api)
+
+        new = get_time_series_since('cfht', 'AM1', data['dates'][2],
+                                    client=self.api)
+        self.assertEqual(new['ci_ids'], data['ci_ids'][3:])
+        self.assertEqual(new['dates'], data['dates'][3:])
+
+        new = get_time_series_since('cfht', 'AM1', data['dates'][-1],
+                                    client=self.api)
+        self.assertEqual(new['ci_ids'], [])
+
+    def test_conditional_requests(self):
+
+        data = self.api.get_data('metrics')
+
+        # a new session revalidates the response seen by the first one
+        api = ApiClient(api_url=self.api_url, session=self.session)
+        self.assertEqual(api.get_data('metrics'), data)
+        self.assertEqual(self.session.status_codes[-1], 304)
+
+        metric = Metric.objects.get(pk='AM1')
+        metric.unit = 'arcsec'
+        metric.save()
+
+        api = ApiClient(api_url=self.api_url, session=self.session)
+        self.assertNotEqual(api.get_data('metrics'), data)
+        self.assertEqual(self.session.status_codes[-1], 200)
+
+    def test_data_cache_eviction(self):
+
+        now = [0]
+        cache = DataCache(maxsize=2, ttl=10, timer=lambda: now[0])
+
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        # b is the least recently used
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+
+        now[0] = 11
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('c'), None)
@@ -13,12 +13,17 @@ api_router.register(r'datasets', views.DatasetViewSet,
                     base_name='datasets')
 api_router.register(r'defaults', views.DefaultsViewSet,
                     base_name='defaults')
+api_router.register(r'cache', views.CacheStatsViewSet,
+                    base_name='cache')
+api_router.register(r'ingestions', views.IngestionViewSet)
 
 # endpoints for data consumed by the bokeh apps
 api_router.register(r'measurements', views.MeasurementViewSet,
                     base_name='measurements')
 api_router.register(r'apps', views.BokehAppViewSet,
                     base_name='apps')
+api_router.register(r'timeseries', views.TimeSeriesViewSet,
+                    base_name='timeseries')
 
 urlpatterns = [
     url(r'^$', views.home, name='home'),
@@ -1,21 +1,28 @@
-from ast import literal_eval
+import json
+from datetime import datetime
 
 from django.shortcuts import render
 from django.http import HttpResponse
 from django.template import loader
 
 from django.conf import settings
-from rest_framework import authentication, permissions,\
-    viewsets, filters, response, status
-
-from rest_framework_extensions.cache.mixins import CacheResponseMixin
+from django.utils import timezone
+from rest_framework import authentication, permissions, \
+    viewsets, filters, response, status, exceptions
+from rest_framework.decorators import list_route
 
 from bokeh.embed import autoload_server
 
-from .forms import JobFilter
-from .models import Job, Metric, Measurement, VersionedPackage
-from .serializers import JobSerializer, MetricSerializer,\
-    RegressionSerializer
+from .cache import CacheResponseMixin, conditional, get_stats, get_summary
+from .forms import JobFilter, MeasurementFilter
+from .ingestion import async_ingestion, prefers_async
+from .models import Job, Metric, Measurement, VersionedPackage, \
+    ChangedPackage, Blob, JobBlob, Ingestion
+from .pagination import KeysetPagination
+from .renderers import COLUMNAR_RENDERER_CLASSES, streaming_response
+from .stats import downsample, get_snr_index
+from .serializers import JobSerializer, MetricSerializer, \
+    MetricUpsertSerializer, RegressionSerializer, IngestionSerializer
 
 
 try:
@@ -24,6 +31,18 @@ except AttributeError:
     # if not specified use the default which is localhost:5006
     bokeh_url = 'default'
 
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Data blobs used by the diagnostic apps
+BLOB_NAMES = ('matchedDataset', 'photomModel', 'astromModel')
+
+
+def to_epoch_ms(date):
+    """Convert a datetime to milliseconds since epoch as used
+    by bokeh datetime axes
+    """
+    return (date - EPOCH).total_seconds() * 1000
+
 
 class DefaultsMixin(object):
     """
@@ -49,8 +68,78 @@ class DefaultsMixin(object):
     )
 
 
-class JobViewSet(DefaultsMixin, CacheResponseMixin, viewsets.ModelViewSet):
-    """API endpoint for listing and creating jobs"""
+class SparseFieldsViewMixin(object):
+    """Restrict the fields of the responses to those requested with the
+    fields or exclude query parameters, e.g. ?fields=ci_id,date,status
+
+    Columns of the fields not requested are not read from the database,
+    and the related objects listed in sparse_prefetch are prefetched only
+    if their field is requested.
+    """
+
+    sparse_prefetch = ()
+
+    def get_sparse_fields(self):
+        """Return the names of the fields requested, or None if every
+        field is requested
+        """
+
+        params = self.request.query_params
+
+        if self.request.method not in permissions.SAFE_METHODS or \
+                not (params.get('fields') or params.get('exclude')):
+            return None
+
+        available = self.get_serializer_class().Meta.fields
+
+        requested = {}
+        for param in ('fields', 'exclude'):
+            requested[param] = [name for name in
+                                params.get(param, '').split(',') if name]
+
+            unknown = set(requested[param]) - set(available)
+            if unknown:
+                raise exceptions.ValidationError(
+                    {param: 'Unknown fields: {}.'.format(
+                        ', '.join(sorted(unknown)))})
+
+        return [name for name in requested['fields'] or available
+                if name not in requested['exclude']]
+
+    def get_queryset(self):
+
+        queryset = super(SparseFieldsViewMixin, self).get_queryset()
+        fields = self.get_sparse_fields()
+
+        if fields is None:
+            return queryset
+
+        # columns ordering the results are read for the pagination cursors
+        ordering = [name.lstrip('-') for name in queryset.query.order_by]
+
+        columns = [field.name for field in queryset.model._meta.concrete_fields
+                   if field.name in fields or field.name in ordering]
+
+        prefetch = [name for name in self.sparse_prefetch if name in fields]
+
+        return queryset.prefetch_related(None).prefetch_related(*prefetch).\
+            only('pk', *columns)
+
+    def get_serializer(self, *args, **kwargs):
+
+        fields = self.get_sparse_fields()
+        if fields is not None:
+            kwargs['fields'] = fields
+
+        return super(SparseFieldsViewMixin, self).get_serializer(*args,
+                                                                 **kwargs)
+
+
+class JobViewSet(DefaultsMixin, SparseFieldsViewMixin, CacheResponseMixin,
+                 viewsets.ModelViewSet):
+    """API endpoint for listing and creating jobs, the fields listed can
+    be restricted with the fields or exclude query parameters
+    """
 
     queryset = Job.objects.\
         prefetch_related('packages', 'measurements').order_by('date')
@@ -58,6 +147,31 @@ class JobViewSet(DefaultsMixin, CacheResponseMixin, viewsets.ModelViewSet):
     filter_class = JobFilter
     search_fields = ('ci_id',)
     ordering_fields = ('date',)
+    pagination_class = KeysetPagination
+    sparse_prefetch = ('packages', 'measurements')
+    cache_scopes = ('dataset',)
+    cache_dataset_param = 'ci_dataset'
+    async_ingestion = async_ingestion
+
+    def create(self, request, *args, **kwargs):
+
+        # only JSON payloads are queued, the worker parses them as JSON
+        if not (self.async_ingestion and prefers_async(request)) or \
+                not request.content_type.startswith('application/json'):
+            return super(JobViewSet, self).create(request, *args, **kwargs)
+
+        # the payload is queued without being parsed, it is validated
+        # and written by an ingest_worker process
+        ingestion = Ingestion.objects.enqueue(request.body)
+
+        serializer = IngestionSerializer(ingestion,
+                                         context={'request': request})
+        headers = {'Location': serializer.data['links']['self'],
+                   'Preference-Applied': 'respond-async'}
+
+        return response.Response(serializer.data,
+                                 status=status.HTTP_202_ACCEPTED,
+                                 headers=headers)
 
 
 class MeasurementViewSet(DefaultsMixin, CacheResponseMixin,
@@ -65,9 +179,14 @@ class MeasurementViewSet(DefaultsMixin, CacheResponseMixin,
     """API endpoint consumed by the monitor app"""
 
     queryset = Measurement.objects.\
-        prefetch_related('job', 'metric').order_by('job__date')
+        prefetch_related('job', 'metric', 'job__changed_packages').\
+        order_by('job__date')
     serializer_class = RegressionSerializer
-    filter_fields = ('job__ci_dataset', 'metric')
+    filter_class = MeasurementFilter
+    pagination_class = KeysetPagination
+    cache_scopes = ('dataset', 'metric')
+    cache_dataset_param = 'job__ci_dataset'
+    cache_metric_param = 'metric'
 
 
 class MetricViewSet(DefaultsMixin, CacheResponseMixin, viewsets.ModelViewSet):
@@ -85,13 +204,43 @@ class MetricViewSet(DefaultsMixin, CacheResponseMixin, viewsets.ModelViewSet):
         return response.Response(serializer.data,
                                  status=status.HTTP_201_CREATED)
 
+    @list_route(methods=['post'])
+    def upsert(self, request):
+        """Create or update metric definitions in bulk, posting the same
+        definitions again leaves the metrics unchanged
+        """
+
+        data = request.data if isinstance(request.data, list) else \
+            [request.data]
+
+        serializer = MetricUpsertSerializer(data=data, many=True)
+        serializer.is_valid(raise_exception=True)
+
+        definitions = serializer.validated_data
+        names = [definition['metric'] for definition in definitions]
+
+        if len(set(names)) != len(names):
+            raise exceptions.ValidationError(
+                'Metrics must be defined only once.')
+
+        created, updated, unchanged = Metric.objects.upsert(definitions)
+
+        return response.Response({'created': len(created),
+                                  'updated': len(updated),
+                                  'unchanged': len(unchanged)})
+
     search_fields = ('metric', )
     ordering_fields = ('metric',)
+    cache_scopes = ('metric',)
+    cache_metric_param = 'pk'
 
 
 class DatasetViewSet(DefaultsMixin, viewsets.ViewSet):
     """API endpoint for listing datasets"""
 
+    cache_scopes = ('dataset',)
+
+    @conditional
     def list(self, request):
         datasets = Job.objects.values_list('ci_dataset', flat=True).distinct()
         return response.Response(datasets)
@@ -103,6 +252,8 @@ class DefaultsViewSet(DefaultsMixin, viewsets.ViewSet):
     the bokeh apps
     """
 
+    cache_scopes = ('dataset', 'metric')
+
     def get_defaults(self):
         queryset = Job.objects.values('ci_id', 'ci_dataset').latest('pk')
 
@@ -123,50 +274,154 @@ class DefaultsViewSet(DefaultsMixin, viewsets.ViewSet):
                 'metric': metric, 'snr_cut': snr_cut,
                 'window': window}
 
+    @conditional
     def list(self, request):
         defaults = self.get_defaults()
         return response.Response(defaults)
 
 
+class TimeSeriesViewSet(DefaultsMixin, viewsets.ViewSet):
+    """API endpoint consumed by the monitor app, returns the
+    measurements of a metric for a dataset in column-oriented form
+    """
+
+    renderer_classes = COLUMNAR_RENDERER_CLASSES
+
+    cache_scopes = ('dataset', 'metric')
+    cache_dataset_param = 'ci_dataset'
+    cache_metric_param = 'metric'
+
+    def get_time_series(self, params):
+
+        measurements = MeasurementFilter(params,
+                                         queryset=Measurement.objects).qs
+
+        rows = measurements.order_by('job__date').\
+            values_list('job_id', 'job__ci_id', 'job__date', 'value',
+                        'job__ci_url')
+
+        changed = ChangedPackage.objects.\
+            filter(job__in=measurements.values('job')).\
+            order_by('pk').values_list('job_id', 'name', 'git_commit',
+                                       'git_url')
+
+        names = {}
+        git_urls = {}
+        for job_id, name, git_commit, git_url in changed:
+            if git_url.endswith('.git'):
+                git_url = git_url[:-4]
+            names.setdefault(job_id, []).append(name)
+            git_urls.setdefault(job_id, []).append(
+                "{}/commit/{}".format(git_url, git_commit))
+
+        data = {'ci_ids': [], 'dates': [], 'values': [], 'ci_urls': [],
+                'names': [], 'git_urls': []}
+
+        for job_id, ci_id, date, value, ci_url in rows:
+            data['ci_ids'].append(ci_id)
+            data['dates'].append(to_epoch_ms(date))
+            data['values'].append(value)
+            data['ci_urls'].append(ci_url)
+            data['names'].append(names.get(job_id, []))
+            data['git_urls'].append(git_urls.get(job_id, []))
+
+        return data
+
+    @conditional
+    def list(self, request):
+
+        defaults = DefaultsViewSet().get_defaults()
+
+        ci_dataset = self.request.query_params.get('ci_dataset',
+                                                   defaults['ci_dataset'])
+        metric = self.request.query_params.get('metric',
+                                               defaults['metric'])
+        window = self.request.query_params.get('window',
+                                               defaults['window'])
+
+        params = {'job__ci_dataset': ci_dataset, 'metric': metric,
+                  'window': window,
+                  'since': self.request.query_params.get('since'),
+                  'until': self.request.query_params.get('until')}
+
+        data = self.get_time_series(params)
+
+        return streaming_response(request, data)
+
+
 class BokehAppViewSet(DefaultsMixin, viewsets.ViewSet):
+    """API endpoint consumed by the diagnostic apps"""
 
-    def get_app_data(self, ci_id, ci_dataset, metric):
+    renderer_classes = COLUMNAR_RENDERER_CLASSES
 
-        data = {}
+    cache_scopes = ('dataset', 'metric')
+    cache_dataset_param = 'ci_dataset'
+    cache_metric_param = 'metric'
 
-        blobs = Job.objects.filter(ci_id=ci_id,
-                                   ci_dataset=ci_dataset).values('blobs')
+    def get_blob_ids(self, ci_id, ci_dataset, metric,
+                     blob_names=BLOB_NAMES):
+        """Return the metadata of a measurement, and the ids in the blob
+        store of its data blobs by name
+        """
 
+        # values_list() returns the JSON text as stored in the database,
+        # it is parsed once here
         metadata = Measurement.\
             objects.filter(metric=metric, job__ci_id=ci_id,
-                           job__ci_dataset=ci_dataset).values('metadata')
-
-        if metadata.exists():
-            # workaround for getting item from queryset
-            metadata = metadata[0]['metadata']
-            if metadata:
-                metadata = literal_eval(literal_eval(metadata))
-                blob_id = metadata.pop('blobs')
-                data['metadata'] = metadata
-
-                if blobs.exists():
-                    # workaround for getting item from queryset
-                    blobs = blobs[0]['blobs']
-                    if blobs:
-                        blobs = literal_eval(literal_eval(blobs))
-                        for blob in blobs:
-                            # Look up for data blobs
-                            if blob['identifier'] == blob_id['matchedDataset']:
-                                data['matchedDataset'] = blob['data']
-
-                            elif blob['identifier'] == blob_id['photomModel']:
-                                data['photomModel'] = blob['data']
-
-                            elif blob['identifier'] == blob_id['astromModel']:
-                                data['astromModel'] = blob['data']
+                           job__ci_dataset=ci_dataset).\
+            values_list('metadata', flat=True).first()
+
+        if not metadata:
+            return None, {}
+
+        metadata = json.loads(metadata)
+        if not isinstance(metadata, dict) or 'blobs' not in metadata:
+            return None, {}
+
+        blob_id = metadata.pop('blobs')
+
+        # Look up for data blobs
+        names = {blob_id[name]: name for name in blob_names
+                 if name in blob_id}
+
+        blobs = JobBlob.objects.\
+            filter(job__ci_id=ci_id, job__ci_dataset=ci_dataset,
+                   identifier__in=list(names)).\
+            values_list('identifier', 'blob_id')
+
+        return metadata, {names[identifier]: blob_id
+                          for identifier, blob_id in blobs}
+
+    def get_app_data(self, metadata, blob_ids):
+        """Return the metadata and the data blobs of a measurement"""
+
+        data = {}
+
+        if metadata is not None:
+            data['metadata'] = metadata
+
+        # blobs are loaded from the blob store only here
+        blobs = Blob.objects.filter(pk__in=set(blob_ids.values()))
+        blobs = {blob.pk: blob.load() for blob in blobs}
+
+        for name, blob_id in blob_ids.items():
+            data[name] = blobs[blob_id]
+
         return data
 
-    def list(self, request):
+    def get_statistics(self, blob_ids, snr_cut):
+        """Statistics of the matched dataset for an SNR cut, computed with
+        the SNR index of the matched dataset
+        """
+
+        if 'matchedDataset' not in blob_ids:
+            return {}
+
+        return get_snr_index(blob_ids['matchedDataset']).\
+            get_statistics(snr_cut)
+
+    def get_params(self):
+        """Return the job, dataset, metric and SNR cut requested"""
 
         defaults = DefaultsViewSet().get_defaults()
 
@@ -178,9 +433,72 @@ class BokehAppViewSet(DefaultsMixin, viewsets.ViewSet):
         metric = self.request.query_params.get('metric',
                                                defaults['metric'])
 
-        data = self.get_app_data(ci_id, ci_dataset, metric)
+        snr_cut = self.request.query_params.get('snr_cut',
+                                                defaults['snr_cut'])
+        try:
+            snr_cut = float(snr_cut)
+        except ValueError:
+            raise exceptions.ValidationError(
+                {'snr_cut': 'A number is required.'})
 
-        return response.Response(data)
+        return ci_id, ci_dataset, metric, snr_cut
+
+    @conditional
+    def list(self, request):
+
+        ci_id, ci_dataset, metric, snr_cut = self.get_params()
+
+        max_points = self.request.query_params.get('max_points')
+        if max_points is not None:
+            try:
+                max_points = int(max_points)
+            except ValueError:
+                raise exceptions.ValidationError(
+                    {'max_points': 'An integer is required.'})
+
+        metadata, blob_ids = self.get_blob_ids(ci_id, ci_dataset, metric)
+
+        data = self.get_app_data(metadata, blob_ids)
+
+        # statistics are computed on the full dataset, the apps plot
+        # at most max_points stars
+        if 'matchedDataset' in data:
+            data['statistics'] = self.get_statistics(blob_ids, snr_cut)
+
+            if max_points is not None:
+                data['matchedDataset'] = downsample(data['matchedDataset'],
+                                                    max_points)
+
+        return streaming_response(request, data)
+
+    @list_route()
+    @conditional
+    def statistics(self, request):
+        """Statistics of the matched dataset for an SNR cut, requested by
+        the apps when the SNR cut changes
+        """
+
+        ci_id, ci_dataset, metric, snr_cut = self.get_params()
+
+        _, blob_ids = self.get_blob_ids(ci_id, ci_dataset, metric,
+                                        blob_names=('matchedDataset',))
+
+        return response.Response(self.get_statistics(blob_ids, snr_cut))
+
+
+class IngestionViewSet(DefaultsMixin, viewsets.ReadOnlyModelViewSet):
+    """API endpoint for the status of the jobs ingested asynchronously"""
+
+    queryset = Ingestion.objects.defer('payload').order_by('-pk')
+    serializer_class = IngestionSerializer
+    filter_fields = ('status',)
+
+
+class CacheStatsViewSet(DefaultsMixin, viewsets.ViewSet):
+    """API endpoint for monitoring the response cache"""
+
+    def list(self, request):
+        return response.Response(get_stats())
 
 
 def embed_bokeh(request, bokeh_app):
@@ -208,23 +526,37 @@ def embed_bokeh(request, bokeh_app):
     return response
 
 
-def home(request):
-    """Render the home page"""
+def compute_summary():
+    """Compute the summary of the database shown by the home page, it is
+    cached until the next write, see dashboard.cache
+    """
 
-    n_metrics = len(Metric.objects.all())
-    job = Job.objects.latest('pk')
-    n_packages = len(VersionedPackage.objects.filter(job=job))
-    n_jobs = len(Job.objects.all())
-    n_meas = len(Measurement.objects.all())
+    last = Job.objects.values('pk', 'date').order_by('-pk').first()
+
+    if last is not None:
+        n_packages = VersionedPackage.objects.filter(job=last['pk']).count()
+        last = {'date': last['date'], 'n_packages': n_packages}
 
     datasets = Job.objects.values_list('ci_dataset', flat=True).distinct()
-    last = Job.objects.latest('pk').date
-
-    context = {"n_metrics": n_metrics,
-               "n_packages": n_packages,
-               "n_jobs": n_jobs,
-               "n_meas": n_meas,
-               "datasets": ", ".join(datasets),
-               "last": last}
+
+    return {'n_metrics': Metric.objects.count(),
+            'n_jobs': Job.objects.count(),
+            'n_meas': Measurement.objects.count(),
+            'datasets': sorted(datasets),
+            'last': last}
+
+
+def home(request):
+    """Render the home page, from the summary kept in the cache"""
+
+    summary = get_summary(compute_summary)
+    last = summary['last'] or {}
+
+    context = {"n_metrics": summary['n_metrics'],
+               "n_packages": last.get('n_packages', 0),
+               "n_jobs": summary['n_jobs'],
+               "n_meas": summary['n_meas'],
+               "datasets": ", ".join(summary['datasets']),
+               "last": last.get('date')}
 
     return render(request, 'dashboard/index.html', context)
@@ -15,11 +15,15 @@ BOKEH_BASE_DIR = os.path.dirname(
 
 sys.path.append(BOKEH_BASE_DIR)
 
-from api_helper import get_url_args, get_data_as_pandas_df # noqa
-from bokeh_helper import add_span_annotation # noqa
+from api_helper import ApiClient, get_url_args, get_data_as_pandas_df, \
+                       get_app_statistics, SQUASH_APP_MAX_POINTS # noqa
+from bokeh_helper import add_span_annotation, SnrSelection # noqa
+
+# Client used to access the API in this session
+client = ApiClient()
 
 # Get url query args
-args = get_url_args(curdoc, defaults={'metric': 'AM1'})
+args = get_url_args(curdoc, defaults={'metric': 'AM1'}, client=client)
 
 
 # App title
@@ -27,32 +31,36 @@ title = Div(text="""<h2>{metric} diagnostic plot for {ci_dataset} dataset from
                     job ID {ci_id}</h2>""".format_map(args))
 
 # Get data
-data = get_data_as_pandas_df(endpoint='apps',
-                             params=args)
+# Data is shared by the sessions requesting the same job, dataset and metric
+params = {key: args[key] for key in ('ci_id', 'ci_dataset', 'metric')}
 
+# At most SQUASH_APP_MAX_POINTS stars are plotted, statistics for the
+# SNR cut are computed by the API on the full dataset
+data = get_data_as_pandas_df(endpoint='apps',
+                             params=dict(params, snr_cut=args['snr_cut'],
+                                         max_points=SQUASH_APP_MAX_POINTS),
+                             client=client)
 
-# Configure bokeh data sources with the full and
-# selected data sets
 
+# Configure the bokeh data source, stars selected by the SNR cut are
+# shown in a different color
 
 snr = {'value': [], 'label': '', 'unit': ''}
-selected_snr = []
-
 dist = {'value': [], 'label': '', 'unit': ''}
-selected_dist = []
+
+# statistics of the selected dist values
+statistics = {'size': 0, 'n': 0, 'median': None, 'rms': None,
+              'full': [0], 'selected': [0], 'edges': [0, 1]}
 
 if not data.empty:
     snr = data['matchedDataset']['snr']
-    index = np.array(snr['value']) > float(args['snr_cut'])
-    selected_snr = np.array(snr['value'])[index]
-
     dist = data['matchedDataset']['dist']
-    index = np.array(snr['value']) > float(args['snr_cut'])
-    selected_dist = np.array(dist['value'])[index]
+
+    statistics = data['statistics']['dist']
 
 
-full = ColumnDataSource(data={'snr': snr['value'], 'dist': dist['value']})
-selected = ColumnDataSource(data={'snr': selected_snr, 'dist': selected_dist})
+source = ColumnDataSource(data={'snr': snr['value'], 'dist': dist['value']})
+selection = SnrSelection(source, snr['value'], float(args['snr_cut']))
 
 # Ranges used in the bokeh widgets
 MIN_SNR = 0
@@ -79,20 +87,12 @@ plot = figure(tools="pan, box_zoom, wheel_zoom, reset",
 # TODO: move size, fill alpha and line_color to plot styling configuration
 
 scatter = plot.circle('snr', 'dist', size=5, fill_alpha=0.2,
-                      source=full, color='lightgray',
+                      source=source, fill_color='color',
                       line_color=None)
 
-scatter.nonselection_glyph = Circle(fill_color='lightgray',
+scatter.nonselection_glyph = Circle(fill_color='color', fill_alpha=0.2,
                                     line_color=None)
 
-partial_scatter = plot.circle('snr', 'dist', size=5, fill_alpha=0.2,
-                              line_color=None, source=selected)
-
-# default bokeh blue color #1f77b4
-partial_scatter.nonselection_glyph = Circle(fill_color="#1f77b4",
-                                            fill_alpha=0.2,
-                                            line_color=None)
-
 # Add annotations to the scatter plot
 # TODO: improve variable naming
 
@@ -109,7 +109,8 @@ plot.add_layout(label1)
 
 # Full histogram
 
-full_hist, edges = np.histogram(full.data['dist'], bins=100)
+full_hist = np.array(statistics['full'])
+edges = np.array(statistics['edges'])
 
 hmax = max(full_hist) * 1.1
 
@@ -126,39 +127,50 @@ hist.quad(left=0, bottom=edges[:-1], top=edges[1:], right=full_hist,
 
 # Partial histogram
 
-partial_hist, _ = np.histogram(selected.data['dist'],
-                               bins=edges)
-
 histogram = hist.quad(left=0, bottom=edges[:-1], top=edges[1:],
-                      right=partial_hist)
+                      right=statistics['selected'])
 
 # Add annotations to the histograms
-n = len(selected.data['dist'])
-median = np.median(selected.data['dist'])
-rms = np.sqrt(np.mean(np.square(selected.data['dist'])))
 
 label2 = Label(x=200, y=400, x_units='screen', y_units='screen',
-               text='Median = {:3.2f} marcsec'.format(median),
                render_mode='css')
 
 hist.add_layout(label2)
 
 label3 = Label(x=200, y=375, x_units='screen', y_units='screen',
-               text='RMS = {:3.2f} marcsec'.format(rms), render_mode='css')
+               render_mode='css')
 
 hist.add_layout(label3)
 
 label4 = Label(x=200, y=425, x_units='screen', y_units='screen',
-               text='N = {}'.format(n), render_mode='css')
+               render_mode='css')
 
 hist.add_layout(label4)
 
-span2 = Span(location=rms,
-             dimension='width', line_color="black",
+span2 = Span(dimension='width', line_color="black",
              line_dash='dashed', line_width=3)
 
 hist.add_layout(span2)
 
+
+def update_statistics(statistics):
+    """Redraw the partial histogram and update n, median and rms"""
+
+    histogram.data_source.data['right'] = statistics['selected']
+
+    n = statistics['n']
+    median = statistics['median'] or 0
+    rms = statistics['rms'] or 0
+
+    span2.location = rms
+
+    label2.text = 'Median = {:3.2f} marcsec'.format(median)
+    label3.text = 'RMS = {:3.2f} marcsec'.format(rms)
+    label4.text = 'N = {}'.format(n)
+
+
+update_statistics(statistics)
+
 # TODO: obtain spec thresholds from the API
 
 add_span_annotation(plot=hist, value=20, text="Minimum", color="red")
@@ -171,39 +183,18 @@ def update(attr, old, new):
 
     snr_cut = snr_slider.value
 
-    # Update the selected sample
-
-    # TODO: Use pandas notation here
-    index = np.array(full.data['snr']) > float(snr_cut)
-
-    # Update the bokeh data source in one step to avoid a warning
-    # re mismatch in length of column data source columns
+    # Update the stars selected, only those that changed are sent
+    selection.update(float(snr_cut))
 
-    tmp = dict(snr=np.array(full.data['snr'])[index],
-               dist=np.array(full.data['dist'])[index])
-
-    selected.data = tmp
-
-    # Redraw the partial histogram
-    partial_hist, _ = np.histogram(selected.data['dist'],
-                                   bins=edges)
-
-    histogram.data_source.data['right'] = partial_hist
-
-    # Recompute n, median and rms
-    n = len(selected.data['dist'])
-    median = np.median(selected.data['dist'])
-    rms = np.sqrt(np.mean(np.square(selected.data['dist'])))
+    # Exact statistics of the full dataset
+    statistics = get_app_statistics(params, snr_cut, client=client)
+    update_statistics(statistics['dist'])
 
     # Update span anotations
     span1.location = snr_cut
-    span2.location = rms
 
     # Update labels
     label1.text = 'SNR > {:3.2f}'.format(snr_cut)
-    label2.text = 'Median = {:3.2f} marcsec'.format(median)
-    label3.text = 'RMS = {:3.2f} marcsec'.format(rms)
-    label4.text = 'N = {}'.format(n)
 
 
 snr_slider.on_change('value', update)
@@ -15,31 +15,40 @@ BOKEH_BASE_DIR = os.path.dirname(
 
 sys.path.append(BOKEH_BASE_DIR)
 
-from api_helper import get_url_args, get_data_as_pandas_df # noqa
-from bokeh_helper import add_span_annotation # noqa
+from api_helper import ApiClient, get_url_args, get_data_as_pandas_df, \
+                       get_app_statistics, SQUASH_APP_MAX_POINTS # noqa
+from bokeh_helper import add_span_annotation, SnrSelection # noqa
 
 
+# Client used to access the API in this session
+client = ApiClient()
+
 # Get url query args
-args = get_url_args(curdoc, defaults={'metric': 'PA1'})
+args = get_url_args(curdoc, defaults={'metric': 'PA1'}, client=client)
 
 # Get data
+# Data is shared by the sessions requesting the same job, dataset and metric
+params = {key: args[key] for key in ('ci_id', 'ci_dataset', 'metric')}
+
+# At most SQUASH_APP_MAX_POINTS stars are plotted, statistics for the
+# SNR cut are computed by the API on the full dataset
 data = get_data_as_pandas_df(endpoint='apps',
-                             params=args)
+                             params=dict(params, snr_cut=args['snr_cut'],
+                                         max_points=SQUASH_APP_MAX_POINTS),
+                             client=client)
 
-# Configure bokeh data sources with the full and
-# selected datasets
+# Configure the bokeh data source, stars selected by the SNR cut are
+# shown in a different color
 
 snr = {'value': [], 'label': '', 'unit': ''}
-selected_snr = []
-
 mag = {'value': [], 'label': '', 'unit': ''}
-selected_mag = []
-
 magrms = {'value': [], 'label': '', 'unit': ''}
-selected_magrms = []
-
 magerr = {'value': [], 'label': '', 'unit': ''}
-selected_magerr = []
+
+# statistics of the selected stars for each column
+empty = {'size': 0, 'n': 0, 'median': None, 'rms': None, 'min': None,
+         'max': None, 'full': [0], 'selected': [0], 'edges': [0, 1]}
+statistics = {'snr': empty, 'magrms': empty, 'magerr': empty}
 
 if not data.empty:
     snr = data['matchedDataset']['snr']
@@ -49,25 +58,16 @@ if not data.empty:
     magrms = data['matchedDataset']['magrms']
     magerr = data['matchedDataset']['magerr']
 
-    # Selected data based on snr_cut
-    index = np.array(snr['value']) > float(args['snr_cut'])
-
-    selected_snr = np.array(snr['value'])[index]
-    selected_mag = np.array(mag['value'])[index]
-    selected_magrms = np.array(magrms['value'])[index]*1000
-    selected_magerr = np.array(magerr['value'])[index]*1000
+    statistics = dict(data['statistics'])
 
 
 # TODO: Use astropy quantity for doing these conversions
-full = ColumnDataSource(data={'snr': snr['value'], 'mag': mag['value'],
-                              'magrms': np.array(magrms['value'])*1000,
-                              'magerr': np.array(magerr['value'])*1000})
+source = ColumnDataSource(data={'snr': snr['value'], 'mag': mag['value'],
+                                'magrms': np.array(magrms['value'])*1000,
+                                'magerr': np.array(magerr['value'])*1000})
 
+selection = SnrSelection(source, snr['value'], float(args['snr_cut']))
 
-selected = ColumnDataSource(data={'snr': selected_snr,
-                                  'mag': selected_mag,
-                                  'magrms': selected_magrms,
-                                  'magerr': selected_magerr})
 # Configure bokeh widgets
 
 # App title
@@ -105,17 +105,11 @@ plot1 = figure(tools="pan, box_zoom, wheel_zoom, reset",
                y_range=(MIN_MAGRMS, MAX_MAGRMS))
 
 scatter1 = plot1.circle('mag', 'magrms', size=5, fill_alpha=0.5,
-                        source=full, color='lightgray', line_color=None)
+                        source=source, fill_color='color', line_color=None)
 
-scatter1.nonselection_glyph = Circle(fill_color='lightgray',
+scatter1.nonselection_glyph = Circle(fill_color='color', fill_alpha=0.5,
                                      line_color=None)
 
-partial_scatter1 = plot1.circle('mag', 'magrms', size=5, fill_alpha=0.5,
-                                source=selected, line_color=None)
-
-partial_scatter1.nonselection_glyph = Circle(fill_color="#1f77b4",
-                                             fill_alpha=0.5, line_color=None)
-
 
 # Scatter plot snr vs. mag
 
@@ -130,24 +124,13 @@ plot2 = figure(tools="pan, box_zoom, wheel_zoom, reset",
                y_range=(MIN_SNR, MAX_SNR),
                x_axis_label=x_axis_label)
 
-scatter2 = plot2.circle('mag', 'snr', size=5, alpha=0.5,
-                        source=full, color='lightgray')
+scatter2 = plot2.circle('mag', 'snr', size=5, fill_alpha=0.5,
+                        source=source, fill_color='color', line_color=None)
 
-scatter2.nonselection_glyph = Circle(fill_color='lightgray',
+scatter2.nonselection_glyph = Circle(fill_color='color', fill_alpha=0.5,
                                      line_color=None)
 
-partial_scatter2 = plot2.circle('mag', 'snr', size=5, fill_alpha=0.5,
-                                source=selected, line_color=None)
-
-partial_scatter2.nonselection_glyph = Circle(fill_color="#1f77b4",
-                                             fill_alpha=0.5, line_color=None)
-min_snr = 0
-if len(selected.data['snr']) > 0:
-    min_snr = np.min(selected.data['snr'])
-
-
-span1 = Span(location=min_snr,
-             dimension='width', line_color='black',
+span1 = Span(dimension='width', line_color='black',
              line_dash='dashed', line_width=3)
 
 plot2.add_layout(span1)
@@ -169,34 +152,17 @@ plot3 = figure(tools="pan, box_zoom, wheel_zoom, reset",
 
 
 scatter3 = plot3.circle('magrms', 'magerr', size=5, fill_alpha=0.5,
-                        source=full, color='lightgray', line_color=None)
+                        source=source, fill_color='color', line_color=None)
 
-scatter3.nonselection_glyph = Circle(fill_color='lightgray',
+scatter3.nonselection_glyph = Circle(fill_color='color', fill_alpha=0.5,
                                      line_color=None)
 
-partial_scatter3 = plot3.circle('magrms', 'magerr', size=5, fill_alpha=0.5,
-                                source=selected, line_color=None)
-
-partial_scatter3.nonselection_glyph = Circle(fill_color="#1f77b4",
-                                             fill_alpha=0.5,
-                                             line_color=None)
-
-max_magerr = 0
-if len(selected.data['magerr']) > 0:
-    max_magerr = np.max(selected.data['magerr'])
-
-span3 = Span(location=max_magerr,
-             dimension='width', line_color='black',
+span3 = Span(dimension='width', line_color='black',
              line_dash='dashed', line_width=3)
 
 plot3.add_layout(span3)
 
-min_snr = 0
-if len(selected.data['snr']) > 0:
-    min_snr = np.min(selected.data['snr'])
-
 label2 = Label(x=200, y=325, x_units='screen', y_units='screen',
-               text='SNR > {:3.2f}'.format(min_snr),
                render_mode='css')
 
 
@@ -208,7 +174,8 @@ plot1.add_layout(label2)
 
 y_axis_label = "{} [mmag]".format(magrms['label'])
 
-full_hist, edges = np.histogram(full.data['magrms'], bins=100)
+full_hist = np.array(statistics['magrms']['full'])
+edges = np.array(statistics['magrms']['edges'])*1000
 
 hmax = max(full_hist) * 1.1
 
@@ -225,32 +192,22 @@ hist.quad(left=0, bottom=edges[:-1], top=edges[1:], right=full_hist,
 
 # Partial histogram
 
-partial_hist, _ = np.histogram(selected.data['magrms'],
-                               bins=edges)
-
 histogram = hist.quad(left=0, bottom=edges[:-1], top=edges[1:],
-                      right=partial_hist)
-
-n = len(selected.data['magrms'])
-
-median = np.median(selected.data['magrms'])
+                      right=statistics['magrms']['selected'])
 
 # Add annotations to the histograms
 
 label4 = Label(x=200, y=325, x_units='screen', y_units='screen',
-               text="N = {}".format(n),
                render_mode='css')
 
 hist.add_layout(label4)
 
 label3 = Label(x=200, y=300, x_units='screen', y_units='screen',
-               text="Median = {:3.2f} mmag".format(median),
                render_mode='css')
 
 hist.add_layout(label3)
 
-span2 = Span(location=median,
-             dimension='width', line_color="black",
+span2 = Span(dimension='width', line_color="black",
              line_dash='dashed', line_width=3)
 
 hist.add_layout(span2)
@@ -260,42 +217,21 @@ add_span_annotation(plot=hist, value=5, text="Design", color="blue")
 add_span_annotation(plot=hist, value=3, text="Stretch", color="green")
 
 
-# Define callbacks
-def update(attr, old, new):
-
-    snr_cut = snr_slider.value
-
-    # Update the selected sample
-    index = np.array(full.data['snr']) > snr_cut
-
-    tmp = dict(snr=np.array(full.data['snr'])[index],
-               mag=np.array(full.data['mag'])[index],
-               magrms=np.array(full.data['magrms'])[index],
-               magerr=np.array(full.data['magerr'])[index])
+def update_statistics(statistics):
+    """Redraw the partial histogram and update n, median, the minimum
+    snr and maximum magerr of the selected stars
+    """
 
-    selected.data = tmp
+    histogram.data_source.data['right'] = statistics['magrms']['selected']
 
-    # Redraw partial histogram
-    partial_hist, _ = np.histogram(selected.data['magrms'], bins=edges)
-    histogram.data_source.data['right'] = partial_hist
-
-    # Recompute n, median
-    n = len(selected.data['magrms'])
-    median = np.median(selected.data['magrms'])
+    n = statistics['magrms']['n']
+    median = (statistics['magrms']['median'] or 0)*1000
+    min_snr = statistics['snr']['min'] or 0
+    max_magerr = (statistics['magerr']['max'] or 0)*1000
 
     # Update spans
-
-    min_snr = 0
-    if len(selected.data['snr']) > 0:
-        min_snr = np.min(selected.data['snr'])
-
     span1.location = min_snr
     span2.location = median
-
-    max_magerr = 0
-    if len(selected.data['magerr']) > 0:
-        max_magerr = np.max(selected.data['magerr'])
-
     span3.location = max_magerr
 
     # Update labels
@@ -304,6 +240,21 @@ def update(attr, old, new):
     label4.text = 'N = {}'.format(n)
 
 
+update_statistics(statistics)
+
+
+# Define callbacks
+def update(attr, old, new):
+
+    snr_cut = snr_slider.value
+
+    # Update the stars selected, only those that changed are sent
+    selection.update(float(snr_cut))
+
+    # Exact statistics of the full dataset
+    update_statistics(get_app_statistics(params, snr_cut, client=client))
+
+
 snr_slider.on_change('value', update)
 
 
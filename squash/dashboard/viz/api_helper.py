@@ -1,52 +1,320 @@
+import io
+import json
 import os
+import threading
+import time
+import numpy as np
 import pandas as pd
 import requests
+from collections import OrderedDict
 from datetime import datetime
 from furl import furl
 
 SQUASH_API_URL = os.environ.get('SQUASH_API_URL',
                                 'http://localhost:8000/dashboard/api/')
 
+# Maximum number of keep-alive connections to the API
+SQUASH_API_POOL_SIZE = int(os.environ.get('SQUASH_API_POOL_SIZE', 10))
 
-def get_endpoint_urls():
+# Maximum number of entries and their lifetime in seconds in the data
+# cache shared by the bokeh sessions
+SQUASH_DATA_CACHE_SIZE = int(os.environ.get('SQUASH_DATA_CACHE_SIZE', 64))
+SQUASH_DATA_CACHE_TTL = int(os.environ.get('SQUASH_DATA_CACHE_TTL', 300))
+
+# Maximum number of matched stars plotted by the diagnostic apps
+SQUASH_APP_MAX_POINTS = int(os.environ.get('SQUASH_APP_MAX_POINTS', 20000))
+
+# Maximum number of API responses kept to make conditional requests
+SQUASH_RESPONSE_CACHE_SIZE = int(os.environ.get('SQUASH_RESPONSE_CACHE_SIZE',
+                                                256))
+
+# Request the binary columnar format from the endpoints that support it
+SQUASH_API_BINARY = bool(int(os.environ.get('SQUASH_API_BINARY', 1)))
+
+# Endpoints serving columns of numbers, they can send them as typed arrays
+BINARY_ENDPOINTS = ('apps', 'timeseries')
+
+# Binary columnar format, see dashboard/renderers.py
+NPZ_MEDIA_TYPE = 'application/x-npz'
+
+
+def make_http_session():
+    """Make a requests session with a keep-alive connection pool"""
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=SQUASH_API_POOL_SIZE,
+        pool_maxsize=SQUASH_API_POOL_SIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+# Connection pool shared by all the bokeh sessions in the process
+http_session = make_http_session()
+
+
+def decode_npz(content):
+    """Decode a response in the binary columnar format, lists of numbers
+    are returned as numpy arrays
+    """
+
+    with np.load(io.BytesIO(content), allow_pickle=False) as npz:
+
+        document = json.loads(npz['document'].tobytes().decode('utf-8'))
+
+        def insert(value):
+            if isinstance(value, dict):
+                if '__array__' in value:
+                    return npz[value['__array__']]
+                return {key: insert(item) for key, item in value.items()}
+
+            if isinstance(value, list):
+                return [insert(item) for item in value]
+
+            return value
+
+        return insert(document)
+
+
+def to_list(column):
+    """Return a copy of a column as a list, columns are numpy arrays
+    when they are sent in the binary columnar format
+    """
+
+    if isinstance(column, np.ndarray):
+        return column.tolist()
+
+    return list(column)
+
+
+class DataCache(object):
+    """Least recently used cache with time based expiry.
+
+    Entries older than ttl seconds are expired, and the least recently
+    used entry is evicted when more than maxsize entries are stored.
+    The cache can be used from several threads.
+
+    Parameters
+    ----------
+    maxsize : int
+        maximum number of entries
+    ttl : float
+        lifetime of the entries in seconds
+    timer : callable
+        returns the current time in seconds
+    """
+
+    def __init__(self, maxsize=SQUASH_DATA_CACHE_SIZE,
+                 ttl=SQUASH_DATA_CACHE_TTL, timer=time.time):
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the value stored for key, or default if it is not
+        stored or expired
+        """
+
+        with self.lock:
+            if key not in self.entries:
+                return default
+
+            expires, value = self.entries[key]
+
+            if expires < self.timer():
+                del self.entries[key]
+                return default
+
+            self.entries.move_to_end(key)
+
+            return value
+
+    def set(self, key, value):
+
+        with self.lock:
+            self.entries[key] = (self.timer() + self.ttl, value)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def get_or_set(self, key, compute):
+        """Return the value stored for key, if there is none store
+        and return the value returned by compute()
+        """
+
+        value = self.get(key)
+
+        if value is None:
+            value = compute()
+            self.set(key, value)
+
+        return value
+
+    def clear(self):
+
+        with self.lock:
+            self.entries.clear()
+
+
+# Decoded data shared by the sessions of all the bokeh apps in the process,
+# so that a session showing data already seen does not request it again
+data_cache = DataCache()
+
+# API responses and their validators shared by the bokeh sessions, they
+# do not expire as they are revalidated by the API on every request
+response_cache = DataCache(maxsize=SQUASH_RESPONSE_CACHE_SIZE,
+                           ttl=float('inf'))
+
+
+class ApiClient(object):
+    """Client for the SQuaSH API used by the bokeh apps.
+
+    Connections are taken from the keep-alive pool shared by the process,
+    the API endpoint URLs are looked up once and responses are cached for
+    the lifetime of the client. The apps create one client per bokeh
+    session, so that each session sees up to date data.
+
+    Parameters
+    ----------
+    api_url : str
+        URL of the API root
+    session : requests.Session
+        session used to make the HTTP requests, defaults to the
+        session shared by the process
+    binary : bool
+        request the binary columnar format from the endpoints that
+        support it
+    """
+
+    def __init__(self, api_url=SQUASH_API_URL, session=None,
+                 binary=SQUASH_API_BINARY):
+
+        self.api_url = api_url
+        self.session = session or http_session
+        self.binary = binary
+        self.endpoints = None
+        self.cache = {}
+
+    def get(self, url, params=None, binary=False):
+        """Make a GET request and return the decoded response.
+
+        If binary is True the binary columnar format is requested, it
+        must be supported by the endpoint.
+
+        If the response to the same request was seen before, it is
+        requested conditionally and the previous response is reused if
+        the API answers that it is not modified.
+        """
+
+        key = (url, tuple(sorted((params or {}).items())), binary)
+        cached = response_cache.get(key)
+
+        headers = {}
+        if binary:
+            headers['Accept'] = NPZ_MEDIA_TYPE
+
+        if cached is not None:
+            etag, last_modified, data = cached
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        r = self.session.get(url, params=params, headers=headers)
+
+        if cached is not None and r.status_code == 304:
+            return data
+
+        r.raise_for_status()
+
+        if r.headers.get('Content-Type', '').startswith(NPZ_MEDIA_TYPE):
+            data = decode_npz(r.content)
+        else:
+            data = r.json()
+
+        etag = r.headers.get('ETag')
+        last_modified = r.headers.get('Last-Modified')
+        if etag or last_modified:
+            response_cache.set(key, (etag, last_modified, data))
+
+        return data
+
+    def get_endpoint_urls(self):
+        """Lookup API endpoint URLs"""
+
+        if self.endpoints is None:
+            self.endpoints = self.get(self.api_url)
+
+        return self.endpoints
+
+    def get_data(self, endpoint, params=None):
+        """Return data as a dict from an API endpoint, responses
+        are cached by endpoint and params.
+
+        The cached object is returned, callers must not modify it.
+        """
+
+        key = (endpoint, tuple(sorted((params or {}).items())))
+
+        if key not in self.cache:
+            api = self.get_endpoint_urls()
+            # e.g. http://localhost:8000/AMx?ci_id=1&ci_dataset=cfht&metric=AM1
+            self.cache[key] = self.get(
+                api[endpoint], params,
+                binary=self.binary and endpoint in BINARY_ENDPOINTS)
+
+        return self.cache[key]
+
+
+def get_endpoint_urls(client=None):
     """
     Lookup API endpoint URLs
     """
 
-    r = requests.get(SQUASH_API_URL)
-    r.raise_for_status()
+    client = client or ApiClient()
 
-    return r.json()
+    return client.get_endpoint_urls()
 
 
-def get_data(endpoint, params=None):
+def get_data(endpoint, params=None, client=None):
     """Return data as a dict from
     an API endpoint """
 
-    api = get_endpoint_urls()
+    client = client or ApiClient()
+
+    return client.get_data(endpoint, params)
+
 
-    # e.g. http://localhost:8000/AMx?ci_id=1&ci_dataset=cfht&metric=AM1
-    r = requests.get(api[endpoint],
-                     params=params)
-    r.raise_for_status()
+def get_cache_key(endpoint, params, client):
+    """Key for the data cache"""
 
-    return r.json()
+    return (client.api_url, endpoint, tuple(sorted((params or {}).items())))
 
 
-def get_data_as_pandas_df(endpoint, params=None):
+def get_data_as_pandas_df(endpoint, params=None, client=None):
     """
     Return data as a pandas dataframe from
-    an API endpoint
+    an API endpoint, the dataframe is shared by all the bokeh sessions
+    and must not be modified
     """
 
-    result = get_data(endpoint, params)
+    client = client or ApiClient()
 
-    data = pd.DataFrame.from_dict(result, orient='index').transpose()
+    def compute():
+        result = get_data(endpoint, params, client)
+        return pd.DataFrame.from_dict(result, orient='index').transpose()
 
-    return data
+    return data_cache.get_or_set(get_cache_key(endpoint, params, client),
+                                 compute)
 
 
-def get_datasets(default=None):
+def get_datasets(default=None, client=None):
     """Get a list of datasets from the API
     and a default value
     Returns
@@ -58,8 +326,10 @@ def get_datasets(default=None):
         the default value obtained from the API
     """
 
-    datasets = get_data('datasets')
-    default_dataset = get_data('defaults')['ci_dataset']
+    client = client or ApiClient()
+
+    datasets = get_data('datasets', client=client)
+    default_dataset = get_data('defaults', client=client)['ci_dataset']
 
     if default:
         if default in datasets:
@@ -68,7 +338,7 @@ def get_datasets(default=None):
     return {'datasets': datasets, 'default': default_dataset}
 
 
-def get_metrics(default=None):
+def get_metrics(default=None, client=None):
     """Get the list of metrics from the API
     and a default value
     Returns
@@ -80,10 +350,12 @@ def get_metrics(default=None):
         the default value returned from the API
     """
 
-    r = get_data('metrics')
+    client = client or ApiClient()
+
+    r = get_data('metrics', client=client)
     metrics = [m['metric'] for m in r['results']]
 
-    default_metric = get_data('defaults')['metric']
+    default_metric = get_data('defaults', client=client)['metric']
 
     if default:
         if default in metrics:
@@ -117,7 +389,7 @@ def get_value(specs, name):
     return value
 
 
-def get_specs(name):
+def get_specs(name, client=None):
     """Get metric specifications thresholds
     from its name
     Parameters
@@ -138,7 +410,7 @@ def get_specs(name):
         metric stretch goal
     """
 
-    r = get_data('metrics')
+    r = get_data('metrics', client=client)
 
     unit = str()
     description = str()
@@ -164,7 +436,40 @@ def get_specs(name):
             'minimum': minimum, 'design': design, 'stretch': stretch}
 
 
-def get_url_args(doc, defaults=None):
+def get_app_statistics(params, snr_cut, client=None):
+    """Get the statistics of the matched dataset of a job for an SNR cut,
+    computed by the API on the full dataset
+
+    Parameters
+    ----------
+    params : dict
+        ci_id, ci_dataset and metric of the job
+    snr_cut : float
+        only the stars with snr greater than snr_cut are selected
+    client : ApiClient
+        client used to access the API
+
+    Returns
+    -------
+    statistics : dict
+        for each column of the matched dataset, the size and histogram
+        of the full dataset, and n, median, rms, min, max and histogram
+        of the selected stars
+    """
+
+    # http://localhost:8000/dashboard/api/apps/statistics/?ci_id=1&ci_dataset=cfht&metric=AM1&snr_cut=100
+
+    client = client or ApiClient()
+
+    # requests are not cached by the client, as they are made each time
+    # the SNR cut changes, they are revalidated by the API instead
+    api = client.get_endpoint_urls()
+
+    return client.get('{}statistics/'.format(api['apps']),
+                      dict(params, snr_cut=snr_cut))
+
+
+def get_url_args(doc, defaults=None, client=None):
     """Return url args recovered from django_full_path cookie in
     the bokeh request header.
 
@@ -172,7 +477,8 @@ def get_url_args(doc, defaults=None):
     obtained from the API
     """
 
-    args = get_data('defaults')
+    # copy, the api defaults are cached by the client
+    args = dict(get_data('defaults', client=client))
 
     # overwrite api default values
     if defaults:
@@ -196,37 +502,9 @@ def get_url_args(doc, defaults=None):
     return args
 
 
-# TODO: these functions are used by the monitor app and need refactoring
-def get_initial_page(page_size, num_pages, window):
-
-    # Page size in hours assuming CI_TIME_INTERVAL
-
-    CI_TIME_INTERVAL = 8
-
-    page_window = page_size * CI_TIME_INTERVAL
-
-    if window == 'weeks':
-        initial_page = num_pages - int((24*7)/page_window)
-    elif window == 'months':
-        # maximum window of 3 months
-        initial_page = num_pages - int((24*30*3)/page_window)
-    elif window == 'years':
-        # maximum window of 1 year
-        initial_page = num_pages - int((24*365)/page_window)
-    else:
-        # everything
-        initial_page = 1
-
-    # Make sure we have enough pages for the input time window
-    if initial_page < 1:
-        initial_page = 1
-
-    return initial_page
-
-
-def get_meas_by_dataset_and_metric(selected_dataset, selected_metric, window):
-    """ Get measurements for a given dataset and metric from the measurements
-    api endpoint
+def get_time_series(selected_dataset, selected_metric, window, client=None):
+    """ Get measurements for a given dataset and metric from the timeseries
+    api endpoint, in column-oriented form
 
     Parameters
     ----------
@@ -234,81 +512,89 @@ def get_meas_by_dataset_and_metric(selected_dataset, selected_metric, window):
         the current selected dataset
     selected_metric : str
         the current selected metric
+    window : str
+        the current selected time window, weeks, months or years
+    client : ApiClient
+        client used to access the API
 
     Returns
     -------
-    ci_id : list
-        list of job ids from the CI system
-    dates : list
-        list of datetimes for each job  measurement
-    measurements : list
-        flat list of dicts where the key is the metric and the value
-        is its measurement
-    ci_url : list
-        list of URLs for the jobs in the CI system
+    data : dict
+        ci_ids, dates (as milliseconds since epoch), values, ci_urls,
+        names and git_urls of the changed packages, one list per key
+        with one item per measurement
     """
-    api = get_endpoint_urls()
 
-    # http://localhost:8000/dashboard/api/measurements/?job__ci_dataset=cfht&metric=AM1
+    # http://localhost:8000/dashboard/api/timeseries/?ci_dataset=cfht&metric=AM1&window=weeks
 
-    r = requests.get(api['measurements'],
-                     params={'job__ci_dataset': selected_dataset,
-                             'metric': selected_metric})
-    r.raise_for_status()
+    client = client or ApiClient()
 
-    results = r.json()
+    params = {'ci_dataset': selected_dataset,
+              'metric': selected_metric,
+              'window': window}
 
-    # results are paginated, walk through each page
+    def compute():
+        # copy, the response is cached by the client
+        data = dict(get_data('timeseries', params, client))
 
-    # TODO: figure out how to retrieve the number of pages in DRF
-    count = results['count']
-    page_size = len(results['results'])
+        # job ids are used to find missing jobs
+        data['ci_ids'] = [int(ci_id) for ci_id in data['ci_ids']]
 
-    measurements = []
-    if page_size > 0:
-        # ceiling integer
-        num_pages = int(count/page_size) + (count % page_size > 0)
+        return data
 
-        initial_page = get_initial_page(page_size, num_pages, window)
+    data = data_cache.get_or_set(get_cache_key('timeseries', params, client),
+                                 compute)
 
-        for page in range(initial_page, num_pages + 1):
-            r = requests.get(
-                api['measurements'],
-                params={'job__ci_dataset': selected_dataset,
-                        'metric': selected_metric,
-                        'page': page})
-            r.raise_for_status()
-            measurements.extend(r.json()['results'])
+    # columns are shared by all the bokeh sessions, return copies
+    # that the session can modify
+    return {key: to_list(column) for key, column in data.items()}
 
-    ci_ids = [int(m['ci_id']) for m in measurements]
 
-    # 2016-08-10T05:22:37.700146Z
-    # after DM-7517 jobs return is sorted by date and the same is done for
-    # the measurements
-    dates = [datetime.strptime(m['date'], '%Y-%m-%dT%H:%M:%S.%fZ')
-             for m in measurements]
+def get_time_series_since(selected_dataset, selected_metric, since,
+                          client=None):
+    """ Get measurements for a given dataset and metric newer than a given
+    date, used to poll the timeseries api endpoint for new measurements
 
-    values = [m['value'] for m in measurements]
+    Parameters
+    ----------
+    selected_dataset : str
+        the current selected dataset
+    selected_metric : str
+        the current selected metric
+    since : float
+        date of the last measurement seen, as milliseconds since epoch
+    client : ApiClient
+        client used to access the API
 
-    ci_urls = [m['ci_url'] for m in measurements]
+    Returns
+    -------
+    data : dict
+        the measurements made after since, in the same form as returned
+        by get_time_series()
+    """
+
+    # http://localhost:8000/dashboard/api/timeseries/?ci_dataset=cfht&metric=AM1&window=all&since=2016-08-10T05:22:37.700146Z
 
-    packages = [m['changed_packages'] for m in measurements]
+    client = client or ApiClient()
 
-    # list of package names, name is the first element in the tuple
-    names = []
-    for i, sublist in enumerate(packages):
-        names.append([])
-        for package in sublist:
-            names[i].append(package[0])
+    params = {'ci_dataset': selected_dataset,
+              'metric': selected_metric,
+              'window': 'all',
+              'since': datetime.utcfromtimestamp(since/1000).
+              strftime('%Y-%m-%dT%H:%M:%S.%fZ')}
 
-    # list of git urls, git package commit sha and base url are the second and
-    # third elements in the tuple
-    git_urls = []
-    for i, sublist in enumerate(packages):
-        git_urls.append([])
-        for package in sublist:
-            git_urls[i].append("{}/commit/{}".format(package[2].strip('.git'),
-                                                     package[1]))
+    # the request is made on every poll, it is not cached by the client but
+    # revalidated by the API so that nothing is sent when there is no
+    # new measurement
+    api = client.get_endpoint_urls()
+    data = client.get(api['timeseries'], params, binary=client.binary)
+    data = {key: to_list(column) for key, column in data.items()}
 
-    return {'ci_ids': ci_ids, 'dates': dates, 'values': values,
-            'ci_urls': ci_urls, 'names': names, 'git_urls': git_urls}
+    # since is inclusive and rounded to microseconds, skip the
+    # measurements already seen
+    new = [i for i, date in enumerate(data['dates']) if date > since]
+
+    data = {key: [column[i] for i in new] for key, column in data.items()}
+    data['ci_ids'] = [int(ci_id) for ci_id in data['ci_ids']]
+
+    return data
@@ -1,5 +1,11 @@
+import numpy as np
 from bokeh.models import Span, Label
 
+# Colors of the stars selected and not selected by the SNR cut, selected
+# stars use the default bokeh blue
+SELECTED_COLOR = '#1f77b4'
+UNSELECTED_COLOR = 'lightgray'
+
 
 def add_span_annotation(plot, value, text, color):
     """ Add span annotation, used for metric specification
@@ -17,3 +23,52 @@ def add_span_annotation(plot, value, text, color):
 
     plot.add_layout(span)
     plot.add_layout(label)
+
+
+class SnrSelection(object):
+    """Selection of the stars with snr greater than a cut, stored as the
+    color column of the data source plotted.
+
+    When the cut changes only the colors of the stars that changed
+    state are patched, they are found by a binary search in the snr
+    values sorted once.
+
+    Parameters
+    ----------
+    source : ColumnDataSource
+        data source of the stars, the color column is added to it
+    snr : list
+        snr of the stars, in the order of the data source
+    snr_cut : float
+        initial SNR cut
+    """
+
+    def __init__(self, source, snr, snr_cut):
+
+        snr = np.asarray(snr, dtype=float)
+
+        self.order = np.argsort(snr, kind='mergesort')
+        self.snr = snr[self.order]
+        self.source = source
+        self.snr_cut = snr_cut
+
+        self.source.data['color'] = np.where(
+            snr > snr_cut, SELECTED_COLOR, UNSELECTED_COLOR).tolist()
+
+    def update(self, snr_cut):
+        """Patch the colors of the stars whose selection changed"""
+
+        start, end = np.searchsorted(self.snr,
+                                     sorted([self.snr_cut, snr_cut]),
+                                     side='right')
+
+        # stars between the two cuts are deselected if the cut increases
+        # and selected if it decreases
+        color = UNSELECTED_COLOR if snr_cut > self.snr_cut \
+            else SELECTED_COLOR
+
+        if end > start:
+            self.source.patch({'color': [(int(i), color)
+                                         for i in self.order[start:end]]})
+
+        self.snr_cut = snr_cut
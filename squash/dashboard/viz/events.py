@@ -0,0 +1,169 @@
+"""Notification of new jobs to the bokeh sessions.
+
+The API publishes an event when a job is ingested, as a JSON datagram
+sent to a local UDP socket, see dashboard/events.py. The bokeh server
+listens on that socket and forwards each event to the sessions showing
+the dataset and one of the metrics of the job, so that they do not need
+to poll the API often.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import weakref
+
+# Address where the bokeh server listens to events, also imported by
+# dashboard/events.py to publish them. Set it to an empty string to
+# disable notifications
+SQUASH_EVENTS_ADDRESS = os.environ.get('SQUASH_EVENTS_ADDRESS',
+                                       'localhost:5007')
+
+# Maximum size of an event datagram
+MAX_EVENT_SIZE = 65507
+
+logger = logging.getLogger(__name__)
+
+
+def parse_address(address):
+    """Return the (host, port) tuple of a host:port address"""
+
+    host, port = address.rsplit(':', 1)
+
+    return host, int(port)
+
+
+class Subscription(object):
+    """Subscription of a bokeh session to the events of a dataset
+    and metric.
+
+    The session updates ci_dataset and metric when it shows another
+    dataset or metric. The callback is held by a weak reference, the
+    subscription ends when the session is destroyed.
+    """
+
+    def __init__(self, callback, ci_dataset, metric):
+
+        self.callback = weakref.WeakMethod(callback)
+        self.ci_dataset = ci_dataset
+        self.metric = metric
+
+    def matches(self, event):
+
+        if event['ci_dataset'] != self.ci_dataset:
+            return False
+
+        return self.metric in event['metrics']
+
+
+class Broker(object):
+    """Forwards the events to the subscribed sessions, from any thread"""
+
+    def __init__(self):
+
+        self.subscriptions = []
+        self.lock = threading.Lock()
+
+    def subscribe(self, callback, ci_dataset, metric):
+        """Call callback(event) for the events of a dataset and metric,
+        callback must be a bound method
+        """
+
+        subscription = Subscription(callback, ci_dataset, metric)
+
+        with self.lock:
+            self.subscriptions.append(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+
+        with self.lock:
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
+
+    def dispatch(self, event):
+        """Call the callbacks of the subscriptions matching the event"""
+
+        with self.lock:
+            # subscriptions of the sessions destroyed are dropped
+            self.subscriptions = [s for s in self.subscriptions
+                                  if s.callback() is not None]
+            callbacks = [s.callback() for s in self.subscriptions
+                         if s.matches(event)]
+
+        for callback in callbacks:
+            if callback is not None:
+                callback(event)
+
+
+class Listener(threading.Thread):
+    """Receives the events published to a local UDP socket and dispatches
+    them to a broker
+    """
+
+    def __init__(self, broker, address):
+
+        super(Listener, self).__init__(daemon=True)
+
+        self.broker = broker
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(parse_address(address))
+        self.socket.settimeout(0.5)
+        self.stopped = threading.Event()
+
+    @property
+    def address(self):
+        """Address the listener is bound to, as host:port"""
+
+        return '{}:{}'.format(*self.socket.getsockname()[:2])
+
+    def run(self):
+
+        while not self.stopped.is_set():
+            try:
+                data = self.socket.recv(MAX_EVENT_SIZE)
+            except socket.timeout:
+                continue
+
+            try:
+                event = json.loads(data.decode('utf-8'))
+            except ValueError:
+                continue
+
+            self.broker.dispatch(event)
+
+        self.socket.close()
+
+    def stop(self):
+
+        self.stopped.set()
+        self.join()
+
+
+_broker = None
+_broker_started = False
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Return the broker of the bokeh server process, listening to the
+    events published by the API, or None if events can't be received
+    """
+
+    global _broker, _broker_started
+
+    with _broker_lock:
+        # the listener is started once, by the first session
+        if not _broker_started and SQUASH_EVENTS_ADDRESS:
+            _broker_started = True
+            broker = Broker()
+            try:
+                Listener(broker, SQUASH_EVENTS_ADDRESS).start()
+            except OSError as e:
+                logger.warning('Could not listen to events on %s: %s',
+                               SQUASH_EVENTS_ADDRESS, e)
+            else:
+                _broker = broker
+
+    return _broker
@@ -1,10 +1,11 @@
 import os
 import sys
-import time
+from datetime import datetime
+import numpy as np
 from bokeh.io import curdoc
-from bokeh.models import ColumnDataSource, HoverTool, Span, Label,\
-    BoxAnnotation
-from bokeh.models.widgets import Select, Div, DataTable, TableColumn,\
+from bokeh.models import ColumnDataSource, HoverTool, Span, Label, \
+    Range1d, CustomJS
+from bokeh.models.widgets import Select, Div, DataTable, TableColumn, \
     HTMLTemplateFormatter
 from bokeh.layouts import row, widgetbox, column
 from defaults import init_time_series_plot
@@ -12,14 +13,31 @@ from defaults import init_time_series_plot
 SQUASH_BASE_URL = os.environ.get('SQUASH_BASE_URL',
                                  'http://localhost:8000')
 
+# Interval in milliseconds between polls for new measurements, when the
+# bokeh server can't receive events from the API
+SQUASH_MONITOR_POLL_INTERVAL = int(os.environ.get(
+    'SQUASH_MONITOR_POLL_INTERVAL', 60000))
+
+# Interval in milliseconds between polls for new measurements when the
+# bokeh server receives events, to show the jobs whose event was lost
+SQUASH_MONITOR_RECONCILE_INTERVAL = int(os.environ.get(
+    'SQUASH_MONITOR_RECONCILE_INTERVAL', 600000))
+
+# Maximum number of measurements kept by a session, the oldest are
+# dropped when new measurements are streamed
+SQUASH_MONITOR_ROLLOVER = int(os.environ.get('SQUASH_MONITOR_ROLLOVER',
+                                             5000))
+
 BASE_DIR = os.path.dirname(
     os.path.dirname(os.path.abspath(__file__))
 )
 
 sys.path.append(os.path.join(BASE_DIR))
 
-from api_helper import get_datasets, get_metrics, get_specs, \
-                   get_meas_by_dataset_and_metric, get_url_args # noqa
+from api_helper import ApiClient, get_datasets, get_metrics, get_specs, \
+                   get_time_series, get_time_series_since, \
+                   get_url_args # noqa
+from events import get_broker # noqa
 
 
 class Metrics(object):
@@ -29,6 +47,9 @@ class Metrics(object):
 
     def __init__(self):
 
+        # client used to access the API in this session
+        self.client = ApiClient()
+
         # app title
         self.title = Div(text="")
 
@@ -42,27 +63,56 @@ class Metrics(object):
                                              'names': [], 'git_urls': [],
                                              })
 
+        # regions of the plot with missing jobs, drawn as quads
+        self.box_source = ColumnDataSource(data={'left': [], 'right': []})
+
         self.compose_layout()
 
+        # new measurements are streamed to the plot and the table when the
+        # API notifies that a job was ingested for the dataset and metric
+        # shown, otherwise the API is polled for them. Events are
+        # datagrams that may be lost, so the API is still polled, slowly.
+        self.doc = curdoc()
+        broker = get_broker()
+
+        if broker is not None:
+            self.subscription = broker.subscribe(self.on_job_event,
+                                                 self.selected_dataset,
+                                                 self.selected_metric)
+            interval = SQUASH_MONITOR_RECONCILE_INTERVAL
+        else:
+            self.subscription = None
+            interval = SQUASH_MONITOR_POLL_INTERVAL
+
+        self.doc.add_periodic_callback(self.poll, interval)
+
+    def on_job_event(self, event):
+        """Handle the notification of a new job, called from the thread
+        receiving the events, the session is updated on its own thread
+        """
+
+        self.doc.add_next_tick_callback(self.poll)
+
     def compose_layout(self):
         """Compose the layout ot the app, the main elements are the widgets to
         select the dataset, the metric, a div for the title, a plot and a table
         """
 
         # Load metrics and datasets
-        self.metrics = get_metrics(default='AM1')
-        self.datasets = get_datasets(default='cfht')
+        self.metrics = get_metrics(default='AM1', client=self.client)
+        self.datasets = get_datasets(default='cfht', client=self.client)
 
         # Get args from the app URL or use defaults
         args = get_url_args(doc=curdoc,
-                            defaults={'metric': self.metrics['default']})
+                            defaults={'metric': self.metrics['default']},
+                            client=self.client)
 
         self.selected_dataset = args['ci_dataset']
 
         self.selected_metric = args['metric']
 
         # get specifications for the selected metric
-        self.specs = get_specs(self.selected_metric)
+        self.specs = get_specs(self.selected_metric, client=self.client)
 
         self.selected_window = args['window']
 
@@ -83,9 +133,10 @@ class Metrics(object):
         metric_select.on_change("value", self.on_metric_change)
 
         self.data = \
-            get_meas_by_dataset_and_metric(self.selected_dataset,
-                                           self.selected_metric,
-                                           self.selected_window)
+            get_time_series(self.selected_dataset,
+                            self.selected_metric,
+                            self.selected_window,
+                            client=self.client)
 
         self.update_data_source()
         self.make_plot()
@@ -125,11 +176,15 @@ class Metrics(object):
         self.loading.text = "Loading..."
 
         self.data = \
-            get_meas_by_dataset_and_metric(new, self.selected_metric,
-                                           self.selected_window)
+            get_time_series(new, self.selected_metric,
+                            self.selected_window,
+                            client=self.client)
 
         self.selected_dataset = new
 
+        if self.subscription is not None:
+            self.subscription.ci_dataset = new
+
         self.update_data_source()
 
         # Update data table columns, the link to the diagnostic bokeh apps
@@ -165,6 +220,9 @@ class Metrics(object):
         self.selected_metric = new
         self.configure_thresholds()
 
+        if self.subscription is not None:
+            self.subscription.metric = new
+
         # update annotations for the metric thresholds
         for t in self.annotations:
             self.annotations[t]['span'].location =\
@@ -172,11 +230,12 @@ class Metrics(object):
             self.annotations[t]['label'].y = self.thresholds[t]['values']
 
         # update specs
-        self.specs = get_specs(self.selected_metric)
+        self.specs = get_specs(self.selected_metric, client=self.client)
 
         self.data = \
-            get_meas_by_dataset_and_metric(self.selected_dataset, new,
-                                           self.selected_window)
+            get_time_series(self.selected_dataset, new,
+                            self.selected_window,
+                            client=self.client)
         # update plot labels
         self.plot.yaxis.axis_label = "{} [{}]".format(new,
                                                       self.specs['unit'])
@@ -207,19 +266,60 @@ class Metrics(object):
 
         self.title.text = self.make_title(title, description)
 
+        self.source.data = self.make_columns(self.data)
+        self.box_source.data = self.get_box_coords()
+
+    def make_columns(self, data):
+        """Make the columns of the bokeh data source from measurements
+        """
+
         # all attributes of a datasource must have the same size
-        size = len(self.data['dates'])
+        size = len(data['dates'])
         units = [self.specs['unit']] * size
 
-        self.source.data = dict(x=self.data['dates'],
-                                y=self.data['values'],
-                                time=[x.strftime("%Y-%m-%d %H:%M:%S")
-                                      for x in self.data['dates']],
-                                ci_ids=self.data['ci_ids'],
-                                ci_urls=self.data['ci_urls'],
-                                units=units,
-                                names=self.data['names'],
-                                git_urls=self.data['git_urls'])
+        # dates are in milliseconds since epoch, columns are copies as
+        # they are extended in place when new measurements are streamed
+        return dict(x=list(data['dates']),
+                    y=list(data['values']),
+                    time=[datetime.utcfromtimestamp(x/1000).
+                          strftime("%Y-%m-%d %H:%M:%S")
+                          for x in data['dates']],
+                    ci_ids=list(data['ci_ids']),
+                    ci_urls=list(data['ci_urls']),
+                    units=units,
+                    names=list(data['names']),
+                    git_urls=list(data['git_urls']))
+
+    def poll(self):
+        """Periodic callback, requests the measurements made after the
+        last one shown and streams them to the plot and the table
+        """
+
+        if not self.data['dates']:
+            return
+
+        new = get_time_series_since(self.selected_dataset,
+                                    self.selected_metric,
+                                    self.data['dates'][-1],
+                                    client=self.client)
+
+        if not new['dates']:
+            return
+
+        # only the new measurements are sent to the browser, the oldest
+        # are dropped to keep the size of the session bounded
+        self.source.stream(self.make_columns(new),
+                           rollover=SQUASH_MONITOR_ROLLOVER)
+
+        for key in self.data:
+            self.data[key].extend(new[key])
+            del self.data[key][:-SQUASH_MONITOR_ROLLOVER]
+
+        # boxes are recomputed as they span the measured values, there is
+        # one per region with missing jobs only
+        self.box_source.data = self.get_box_coords()
+
+        self.loading.text = ""
 
     def make_title(self, title, description=""):
         """ Update page title with the selected metric
@@ -250,13 +350,28 @@ class Metrics(object):
 
         self.plot.add_layout(self.loading)
 
-        self.plot.line(
+        # regions with missing jobs are drawn below the measurements, on
+        # their own y range that they fill. The pan and zoom tools change
+        # every range of the plot, this one is set back at once.
+        boxes_range = Range1d(start=0, end=1)
+        boxes_range.callback = CustomJS(code='cb_obj.start = 0; '
+                                             'cb_obj.end = 1;')
+        self.plot.extra_y_ranges = {'boxes': boxes_range}
+
+        self.plot.quad(left='left', right='right', bottom=0, top=1,
+                       source=self.box_source, y_range_name='boxes',
+                       fill_alpha=0.1, fill_color='red', line_color=None)
+
+        line = self.plot.line(
             x='x', y='y', source=self.source,
             line_width=2, color='black')
 
-        self.plot.circle(x='x', y='y', source=self.source,
+        circle = self.plot.circle(x='x', y='y', source=self.source,
                                   color="black", fill_color="white", size=16,)
 
+        hover.renderers = [line, circle]
+        self.plot.y_range.renderers = [line, circle]
+
         # set y-axis label
         self.plot.yaxis.axis_label = "{} [{}]".format(self.metrics['default'],
                                                       self.specs['unit'])
@@ -266,10 +381,6 @@ class Metrics(object):
         for t in self.thresholds:
             self.annotations[t] = self.make_annotations(self.thresholds[t])
 
-        # box annotations are created once for the default metric and are
-        # not update
-        self.make_box_annotations()
-
     def update_table_columns(self):
         """Format links used in data table"""
 
@@ -362,44 +473,18 @@ class Metrics(object):
         return {'span': span, 'label': label}
 
     def get_box_coords(self):
-        """Get coords used in box annotation
-        """
-
-        last = len(self.data['ci_ids']) - 2
-        start = []
-        end = []
-
-        for i, current in enumerate(self.data['ci_ids']):
-            if i < last:
-                next = self.data['ci_ids'][i+1]
-                if (next - current) > 1:
-                    start.append(time.mktime(
-                        self.data['dates'][i].timetuple())*1000)
-                    end.append(time.mktime(
-                        self.data['dates'][i+1].timetuple())*1000)
-                else:
-                    start.append(time.mktime(
-                        self.data['dates'][i].timetuple())*1000)
-                    end.append(time.mktime(
-                        self.data['dates'][i].timetuple())*1000)
-
-        return zip(start, end)
-
-    def make_box_annotations(self):
-        """Box annotations indicate regions in the plot with missing jobs
-        looking at missing values in the ci_ids list
+        """Get coords of the boxes indicating regions in the plot with
+        missing jobs, looking at missing values in the ci_ids list
         """
 
-        box = []
-        coords = self.get_box_coords()
+        ci_ids = np.asarray(self.data['ci_ids'])
+        dates = np.asarray(self.data['dates'], dtype=float)
 
-        for l, r in coords:
-            b = BoxAnnotation(left=l, right=r, fill_alpha=0.1,
-                              fill_color='red')
-            self.plot.add_layout(b)
-            box.append(b)
+        # index of the measurements followed by missing jobs
+        gaps = np.flatnonzero(np.diff(ci_ids) > 1)
 
-        return box
+        return {'left': dates[gaps].tolist(),
+                'right': dates[gaps + 1].tolist()}
 
     def configure_thresholds(self):
         """Thresholds have values for each metric, a text and color
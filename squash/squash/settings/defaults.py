@@ -38,11 +38,53 @@ INSTALLED_APPS = (
     'debug_toolbar'
 )
 
+# Cached API responses, the generation counters invalidating them and
+# the home page summary are shared by every process reading or writing
+# data: web workers, ingest workers and management commands, so that a
+# write in one process invalidates the responses cached by the others.
+# The cache is a table of the database, created by
+# manage.py createcachetable, so no other service is needed. When the
+# cache holds MAX_ENTRIES entries a third of them is dropped, generation
+# counters included: a dropped counter takes a new value, so the
+# responses depending on it are computed again, never served stale.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'squash_cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', 10000))
+        }
+    }
+}
+
+# Cached API responses are invalidated when the data they depend on is
+# written (see dashboard.cache), so they do not need to expire
 REST_FRAMEWORK_EXTENSIONS = {
-    'DEFAULT_CACHE_RESPONSE_TIMEOUT': 60 * 15
+    'DEFAULT_CACHE_RESPONSE_TIMEOUT': None
 }
 
+# Maximum number of rows written per INSERT when a job is ingested,
+# measurements and packages of a job are written in batches of this size
+BULK_CREATE_BATCH_SIZE = int(os.environ.get('BULK_CREATE_BATCH_SIZE', 500))
+
+# Maximum number of SNR indexes of matched datasets kept in memory by
+# each process, an index takes about 40 bytes per star and column
+SNR_INDEX_CACHE_SIZE = int(os.environ.get('SNR_INDEX_CACHE_SIZE', 8))
+
+# Jobs posted with the Prefer: respond-async header are queued and
+# ingested by the ingest_worker command, otherwise they are ingested by
+# the request. A job still running after INGESTION_TIMEOUT seconds has
+# lost its worker and is ingested again, up to INGESTION_MAX_ATTEMPTS
+# times. The ingest_worker command does nothing if ASYNC_INGESTION is off.
+ASYNC_INGESTION = os.environ.get('ASYNC_INGESTION', 'False') == 'True'
+INGESTION_TIMEOUT = int(os.environ.get('INGESTION_TIMEOUT', 3600))
+INGESTION_MAX_ATTEMPTS = int(os.environ.get('INGESTION_MAX_ATTEMPTS', 3))
+
+# ApiGZipMiddleware comes first, so that it compresses the response
+# returned by the other middlewares, streaming responses are compressed
+# as they are generated. Only the API responses are compressed.
 MIDDLEWARE_CLASSES = (
+    'dashboard.middleware.ApiGZipMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',